@@ -1,26 +1,330 @@
 from bson.errors import InvalidId
-from flask import Flask, request, render_template, redirect, url_for, flash, request, jsonify
+from flask import (Flask, request, render_template, redirect, url_for, flash, request, jsonify, g, has_request_context,
+                   copy_current_request_context, abort)
 from flask_bootstrap import Bootstrap
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
-from pymongo import MongoClient
+from pymongo import MongoClient, IndexModel, UpdateOne, ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError, ExecutionTimeout
+from pymongo import monitoring
 from datetime import datetime, date
 from bson.objectid import ObjectId
+from bson import json_util
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_wtf import FlaskForm
 from wtforms import (StringField, PasswordField, SubmitField, SelectField,
                      IntegerField, DateField, TextAreaField, FieldList, FormField)
 from wtforms.fields.choices import SelectMultipleField
 from wtforms.fields.numeric import DecimalField
-from wtforms.validators import DataRequired, Length, Optional, Email
+from wtforms.validators import DataRequired, Length, Optional, Email, NumberRange, ValidationError
+from wtforms.widgets import html_params
+from markupsafe import Markup, escape
 from functools import wraps
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import base64
+import copy
+import hmac
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
 import datetime
+import click
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'ваш_секретний_ключ'
 app.config['MONGO_URI'] = 'mongodb://localhost:27017/Trader'
-
-client = MongoClient('localhost', 27017)
-db = client['Trader']
+# Пул з'єднань на один процес: maxPoolSize має бути не меншим за кількість потоків воркера
+app.config['MONGO_MAX_POOL_SIZE'] = 100
+app.config['MONGO_MIN_POOL_SIZE'] = 0
+app.config['MONGO_CONNECT_TIMEOUT_MS'] = 5000
+app.config['MONGO_SERVER_SELECTION_TIMEOUT_MS'] = 5000
+app.config['MONGO_SOCKET_TIMEOUT_MS'] = None
+app.config['MONGO_WAIT_QUEUE_TIMEOUT_MS'] = None
+# None — значення за замовчуванням сервера або рядка MONGO_URI
+app.config['MONGO_WRITE_CONCERN'] = None
+app.config['MONGO_JOURNAL'] = None
+app.config['MONGO_READ_CONCERN'] = None
+app.config['MONGO_READ_PREFERENCE'] = 'primary'
+app.config['ACTIVE_CUSTOMERS_LIMIT'] = 20
+app.config['ACTIVE_CUSTOMERS_MAX_LIMIT'] = 500
+app.config['PAGE_SIZE'] = 50
+app.config['MAX_PAGE_SIZE'] = 500
+app.config['ENSURE_INDEXES'] = True
+app.config['MONGO_TRANSACTIONS'] = None
+app.config['SALES_BATCH_LIMIT'] = 10000
+app.config['REF_CACHE_TTL'] = 300
+app.config['REF_CACHE_MAX_ENTRIES'] = 16
+app.config['TYPEAHEAD_LIMIT'] = 10
+app.config['TYPEAHEAD_MAX_LIMIT'] = 100
+app.config['TYPEAHEAD_RECENT_DAYS'] = 90
+app.config['USER_CACHE_TTL'] = 300
+app.config['USER_CACHE_MAX_ENTRIES'] = 1024
+app.config['USER_CACHE_SYNC_INTERVAL'] = 1
+app.config['REPEATED_FIND_THRESHOLD'] = 5
+app.config['MONGO_DEBUG_HEADER'] = False
+# Токен для Prometheus (Authorization: Bearer ...); без нього /metrics бачать лише owner/admin
+app.config['METRICS_TOKEN'] = None
+app.config['PROFILE_DIR'] = 'profiles'
+app.config['PROFILE_INTERVAL'] = 0.005
+app.config['PROFILE_SAMPLE_RATE'] = 0
+app.config['DASHBOARD_TIMEOUT'] = 2.0
+# Окремі ліміти часу для віджетів панелі, напр. {'top_customers': 5.0}; решта — DASHBOARD_TIMEOUT
+app.config['DASHBOARD_WIDGET_TIMEOUTS'] = {}
+app.config['DASHBOARD_LIMIT'] = 5
+app.config['LOW_STOCK_THRESHOLD'] = 5
+# Змінні середовища TRADER_* (значення як JSON) перекривають значення вище ще до створення клієнта Mongo,
+# тож їх бачать і сервер, і всі команди flask, незалежно від того, чи викликано create_app()
+app.config.from_prefixed_env('TRADER')
+
+
+# Форма команди: назва, колекція і структура фільтра без значень
+def query_shape(value):
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [query_shape(item) for item in value[:1]]
+    return '?'
+
+
+def command_shape(command_name, command):
+    collection = command.get('collection') if command_name == 'getMore' else command.get(command_name)
+    if command_name in ('find', 'count', 'distinct'):
+        detail = query_shape(command.get('filter', command.get('query', {})))
+    elif command_name == 'aggregate':
+        detail = [next(iter(stage), '?') for stage in command.get('pipeline', [])]
+    elif command_name in ('update', 'delete'):
+        statements = command.get('updates', command.get('deletes', []))
+        detail = query_shape(statements[0].get('q', {})) if statements else None
+    else:
+        detail = None
+    shape = f'{command_name} {collection}'
+    if detail is not None:
+        shape += ' ' + json.dumps(detail, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return shape
+
+
+class RequestCommandListener(monitoring.CommandListener):
+    # Записує команди Mongo, надіслані під час HTTP-запиту, у g.mongo_commands: (форма, тривалість у секундах)
+    def started(self, event):
+        if has_request_context() and 'mongo_commands' in g:
+            g.mongo_pending[event.request_id] = command_shape(event.command_name, event.command)
+
+    def succeeded(self, event):
+        self.finished(event)
+
+    def failed(self, event):
+        self.finished(event)
+
+    def finished(self, event):
+        if has_request_context() and 'mongo_commands' in g:
+            shape = g.mongo_pending.pop(event.request_id, event.command_name)
+            g.mongo_commands.append((shape, event.duration_micros / 1e6))
+
+
+class RouteMetrics:
+    # Лічильники за маршрутами для /metrics
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.request_seconds = {}
+        self.commands = {}
+        self.command_seconds = {}
+        self.repeated_finds = {}
+
+    def record(self, route, elapsed, commands, repeated):
+        with self.lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            self.request_seconds[route] = self.request_seconds.get(route, 0) + elapsed
+            for shape, duration in commands:
+                key = (route, shape.split(' ', 1)[0])
+                self.commands[key] = self.commands.get(key, 0) + 1
+                self.command_seconds[key] = self.command_seconds.get(key, 0) + duration
+            for shape in repeated:
+                self.repeated_finds[(route, shape)] = self.repeated_finds.get((route, shape), 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {name: dict(getattr(self, name)) for name in
+                    ('requests', 'request_seconds', 'commands', 'command_seconds', 'repeated_finds')}
+
+
+route_metrics = RouteMetrics()
+
+
+
+def mongo_client(config):
+    options = {
+        'maxPoolSize': config['MONGO_MAX_POOL_SIZE'],
+        'minPoolSize': config['MONGO_MIN_POOL_SIZE'],
+        'connectTimeoutMS': config['MONGO_CONNECT_TIMEOUT_MS'],
+        'serverSelectionTimeoutMS': config['MONGO_SERVER_SELECTION_TIMEOUT_MS'],
+        'socketTimeoutMS': config['MONGO_SOCKET_TIMEOUT_MS'],
+        'waitQueueTimeoutMS': config['MONGO_WAIT_QUEUE_TIMEOUT_MS'],
+        'w': config['MONGO_WRITE_CONCERN'],
+        'journal': config['MONGO_JOURNAL'],
+        'readConcernLevel': config['MONGO_READ_CONCERN'],
+        'readPreference': config['MONGO_READ_PREFERENCE']
+    }
+    # connect=False: сокети й фонові потоки моніторингу з'являються лише з першою операцією,
+    # тож клієнт, створений під час імпорту в майстер-процесі, не переходить у воркери після fork
+    return MongoClient(config['MONGO_URI'], connect=False, event_listeners=[RequestCommandListener()],
+                       **{key: value for key, value in options.items() if value is not None})
+
+
+client = mongo_client(app.config)
+db = client.get_default_database('Trader')
+
+# Порівняння назв без урахування регістру для пошуку за префіксом
+NAME_COLLATION = {'locale': 'uk', 'strength': 2}
+
+# Підказки typeahead: спершу документи з найбільшим recent_score (див. refresh-typeahead-scores)
+TYPEAHEAD_RANK_INDEX = IndexModel([('recent_score', DESCENDING), ('name', ASCENDING)], collation=NAME_COLLATION,
+                                  partialFilterExpression={'recent_score': {'$gt': 0}}, name='typeahead_rank')
+
+# Реєстр індексів: колекція -> індекси, які мають існувати
+INDEXES = {
+    'users': [
+        IndexModel([('username', ASCENDING)], unique=True)
+    ],
+    'sales': [
+        IndexModel([('date', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel([('trade_point_id', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel([('product_id', ASCENDING), ('date', DESCENDING)]),
+        IndexModel([('customer_id', ASCENDING), ('date', DESCENDING)]),
+        IndexModel([('seller_id', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)])
+    ],
+    'sales_daily': [
+        IndexModel([('day', ASCENDING), ('trade_point_id', ASCENDING), ('product_id', ASCENDING),
+                    ('seller_id', ASCENDING)], unique=True),
+        IndexModel([('trade_point_id', ASCENDING), ('day', ASCENDING)]),
+        IndexModel([('product_id', ASCENDING), ('day', ASCENDING)]),
+        IndexModel([('seller_id', ASCENDING), ('day', ASCENDING)])
+    ],
+    'supplies': [
+        IndexModel([('product_id', ASCENDING), ('supplier_id', ASCENDING)]),
+        IndexModel([('supplier_id', ASCENDING), ('product_id', ASCENDING), ('order_date', ASCENDING)]),
+        IndexModel([('supplier_order_id', ASCENDING)])
+    ],
+    'products': [
+        IndexModel([('suppliers', ASCENDING)]),
+        IndexModel([('name', ASCENDING), ('_id', ASCENDING)]),
+        IndexModel([('name', ASCENDING)], collation=NAME_COLLATION, name='name_search'),
+        TYPEAHEAD_RANK_INDEX
+    ],
+    'customers': [
+        IndexModel([('name', ASCENDING), ('_id', ASCENDING)]),
+        IndexModel([('name', ASCENDING)], collation=NAME_COLLATION, name='name_search'),
+        TYPEAHEAD_RANK_INDEX
+    ],
+    'suppliers': [
+        IndexModel([('name', ASCENDING)], collation=NAME_COLLATION, name='name_search'),
+        TYPEAHEAD_RANK_INDEX
+    ],
+    'requests': [
+        IndexModel([('date', DESCENDING), ('_id', DESCENDING)])
+    ],
+    'supplier_orders': [
+        IndexModel([('received', ASCENDING)])
+    ],
+    'sellers': [
+        IndexModel([('trade_point_id', ASCENDING)]),
+        IndexModel([('name', ASCENDING)], collation=NAME_COLLATION, name='name_search'),
+        TYPEAHEAD_RANK_INDEX
+    ],
+    'stock': [
+        IndexModel([('trade_point_id', ASCENDING), ('product_id', ASCENDING)], unique=True),
+        IndexModel([('product_id', ASCENDING), ('trade_point_id', ASCENDING)]),
+        IndexModel([('quantity', ASCENDING)])
+    ],
+    'stock_movements': [
+        IndexModel([('trade_point_id', ASCENDING), ('at', ASCENDING)]),
+        IndexModel([('product_id', ASCENDING), ('at', ASCENDING)]),
+        IndexModel([('ref_id', ASCENDING)]),
+        # Кожна позиція замовлення постачальнику потрапляє на склад рівно один раз
+        IndexModel([('ref_id', ASCENDING), ('trade_point_id', ASCENDING), ('product_id', ASCENDING)],
+                   unique=True, partialFilterExpression={'kind': 'receipt'}, name='receipt_once')
+    ],
+    'stock_snapshots': [
+        IndexModel([('trade_point_id', ASCENDING), ('taken_at', DESCENDING)])
+    ]
+}
+
+# Канонічні запити звітів і сторінок: (колекція, фільтр, сортування)
+CANONICAL_QUERIES = {
+    'login': ('users', {'username': 'owner'}, None),
+    'sales': ('sales', {}, [('date', DESCENDING), ('_id', DESCENDING)]),
+    'sales_by_trade_point': ('sales', {'trade_point_id': ObjectId()}, [('date', DESCENDING), ('_id', DESCENDING)]),
+    'sales_by_seller': ('sales', {'seller_id': ObjectId()}, [('date', DESCENDING), ('_id', DESCENDING)]),
+    'customer_sales': ('sales', {'customer_id': ObjectId()}, None),
+    'active_customers': ('sales', {'trade_point_id': {'$in': [ObjectId()]}, 'customer_id': {'$ne': None}}, None),
+    'customers_for_product': ('sales', {'product_id': ObjectId(), 'date': {'$gte': datetime.datetime(2024, 1, 1)}},
+                              None),
+    'profitability': ('sales_daily', {'trade_point_id': ObjectId(), 'day': {'$gte': datetime.datetime(2024, 1, 1)}},
+                      None),
+    'trade_turnover': ('sales_daily', {'trade_point_id': {'$in': [ObjectId()]},
+                                       'day': {'$gte': datetime.datetime(2024, 1, 1)}}, None),
+    'sales_volume': ('sales_daily', {'product_id': ObjectId()}, None),
+    'supplies_info': ('supplies', {'supplier_id': ObjectId(), 'product_id': ObjectId(),
+                                   'order_date': {'$gte': datetime.datetime(2024, 1, 1)}}, None),
+    'suppliers_for_product': ('supplies', {'product_id': ObjectId()}, None),
+    'supplier_orders': ('supplier_orders', {'$or': [{'received': {'$exists': False}}, {'received': False}]}, None),
+    'supplier_orders_receive_list': ('supplier_orders', {'received': {'$ne': True}}, None),
+    'supplier_products': ('products', {'suppliers': ObjectId()}, None),
+    'trade_point_sellers': ('sellers', {'trade_point_id': ObjectId()}, None),
+    'trade_point_stock': ('stock', {'trade_point_id': ObjectId()}, None),
+    'stock_snapshot': ('stock_snapshots', {'trade_point_id': ObjectId(), 'taken_at': {'$lte': datetime.datetime(2024, 1, 1)}},
+                       [('taken_at', DESCENDING)]),
+    'stock_movements_tail': ('stock_movements', {'trade_point_id': ObjectId(),
+                                                 'at': {'$gt': datetime.datetime(2024, 1, 1)}}, None),
+    'low_stock': ('stock', {'quantity': {'$lte': 5}}, [('quantity', ASCENDING)]),
+    'recent_customer_sales': ('sales', {'date': {'$gte': datetime.datetime(2024, 1, 1)}, 'customer_id': {'$ne': None}},
+                              None),
+    'product_stock': ('stock', {'product_id': ObjectId(), 'trade_point_id': {'$in': [ObjectId()]}}, None),
+    'customers': ('customers', {}, [('name', ASCENDING), ('_id', ASCENDING)]),
+    'products': ('products', {}, [('name', ASCENDING), ('_id', ASCENDING)]),
+    'requests': ('requests', {}, [('date', DESCENDING), ('_id', DESCENDING)])
+}
+
+
+def ensure_indexes(*collections):
+    for collection in collections or INDEXES:
+        db[collection].create_indexes(INDEXES[collection])
+
+
+def plan_stages(plan):
+    yield plan.get('stage')
+    for child in [plan.get('inputStage')] + plan.get('inputStages', []):
+        if child:
+            yield from plan_stages(child)
+
+
+@app.cli.command('ensure-indexes')
+def ensure_indexes_command():
+    """Створити всі індекси з реєстру INDEXES."""
+    ensure_indexes()
+    click.echo('Індекси створено.')
+
+
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    """Перевірити через explain(), що канонічні запити не сканують колекції повністю і не сортують у пам'яті."""
+    failed = []
+    for name, (collection, query, sort) in CANONICAL_QUERIES.items():
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain()['queryPlanner']['winningPlan']
+        stages = list(plan_stages(winning_plan.get('queryPlan', winning_plan)))
+        status = 'COLLSCAN' if 'COLLSCAN' in stages else 'SORT' if sort and 'SORT' in stages else 'OK'
+        click.echo(f'{status:8} {name}: {" <- ".join(stages)}')
+        if status != 'OK':
+            failed.append(name)
+    if failed:
+        raise click.ClickException(f'Повне сканування або сортування в пам\'яті: {", ".join(failed)}')
 
 # Налаштування Flask-Login
 login_manager = LoginManager()
@@ -47,13 +351,383 @@ class User(UserMixin):
         return None
 
 
+class UserCache:
+    # LRU-кеш об'єктів User за id з обмеженим часом життя. Зміна користувача піднімає версію
+    # 'users' у cache_versions; кожен процес звіряє її не частіше ніж раз на sync_interval секунд
+    # і при розбіжності очищає свій кеш, тож зміни ролей і видалення діють одразу в усіх процесах
+    def __init__(self, database, ttl, max_entries, sync_interval):
+        self.db = database
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sync_interval = sync_interval
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.version = None
+        self.synced_at = None
+        self.hits = 0
+        self.misses = 0
+
+    def sync(self, now):
+        if self.synced_at is not None and now - self.synced_at < self.sync_interval:
+            return
+        doc = self.db.cache_versions.find_one({'_id': 'users'})
+        version = doc['version'] if doc else 0
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            self.synced_at = now
+
+    def get(self, user_id):
+        now = time.monotonic()
+        self.sync(now)
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry and now - entry['loaded_at'] < self.ttl:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return entry['user']
+            self.misses += 1
+        user_data = self.db.users.find_one({'_id': to_object_id(user_id)})
+        if not user_data:
+            return None
+        user = User(user_data)
+        with self.lock:
+            self.entries[user_id] = {'user': user, 'loaded_at': now}
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        self.db.cache_versions.update_one({'_id': 'users'}, {'$inc': {'version': 1}}, upsert=True)
+        with self.lock:
+            self.entries.pop(str(user_id), None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'size': len(self.entries)
+            }
+
+
+user_cache = UserCache(db, app.config['USER_CACHE_TTL'], app.config['USER_CACHE_MAX_ENTRIES'],
+                       app.config['USER_CACHE_SYNC_INTERVAL'])
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.get(user_id)
+    return user_cache.get(user_id)
+
+
+# Завантажувач посилань у межах одного запиту
+def to_object_id(value):
+    if isinstance(value, ObjectId):
+        return value
+    if value is None:
+        return None
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+def to_datetime(value):
+    # Дати приходять з форм, API і старих документів як ISO-рядки або date
+    if isinstance(value, datetime.datetime) or value is None:
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time())
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def date_range(start_date, end_date):
+    # Період зі звітної форми; кінцева дата входить у період
+    bounds = {}
+    if to_datetime(start_date):
+        bounds['$gte'] = to_datetime(start_date)
+    if to_datetime(end_date):
+        bounds['$lt'] = to_datetime(end_date) + datetime.timedelta(days=1)
+    return bounds
+
+
+# Канонічні типи полів-посилань і дат; кожен запис у ці колекції проходить через normalize()
+CANONICAL_TYPES = {
+    'sales': {'trade_point_id': ObjectId, 'seller_id': ObjectId, 'product_id': ObjectId, 'customer_id': ObjectId,
+              'date': datetime.datetime},
+    'sellers': {'trade_point_id': ObjectId},
+    'products': {'suppliers': ObjectId},
+    'requests': {'trade_point_id': ObjectId, 'date': datetime.datetime, 'products_requested.product_id': ObjectId},
+    'supplier_orders': {'supplier_id': ObjectId, 'order_date': datetime.datetime, 'related_requests': ObjectId,
+                        'products_ordered.product_id': ObjectId}
+}
+
+
+def canonical_value(field_type, value):
+    converted = to_object_id(value) if field_type is ObjectId else to_datetime(value)
+    # Значення, яке не вдається перетворити, лишаємо як є
+    return value if converted is None else converted
+
+
+def normalize(collection, doc):
+    for field, field_type in CANONICAL_TYPES.get(collection, {}).items():
+        parent_field, _, child_field = field.partition('.')
+        if doc.get(parent_field) is None:
+            continue
+        if child_field:
+            for item in doc[parent_field]:
+                if child_field in item:
+                    item[child_field] = canonical_value(field_type, item[child_field])
+        elif isinstance(doc[parent_field], list):
+            doc[parent_field] = [canonical_value(field_type, value) for value in doc[parent_field]]
+        else:
+            doc[parent_field] = canonical_value(field_type, doc[parent_field])
+    return doc
+
+
+@app.cli.command('migrate-types')
+@click.option('--batch-size', default=1000, show_default=True)
+def migrate_types(batch_size):
+    """Переписати посилання та дати в існуючих документах у канонічні типи (ObjectId, datetime)."""
+    for collection, fields in CANONICAL_TYPES.items():
+        top_fields = {field.partition('.')[0] for field in fields}
+        updates = []
+        changed = 0
+        for doc in db[collection].find({}, {field: 1 for field in top_fields}).batch_size(batch_size):
+            normalized = normalize(collection, copy.deepcopy(doc))
+            diff = {field: normalized[field] for field in top_fields if normalized.get(field) != doc.get(field)}
+            if diff:
+                updates.append(UpdateOne({'_id': doc['_id']}, {'$set': diff}))
+            if len(updates) == batch_size:
+                changed += db[collection].bulk_write(updates, ordered=False).modified_count
+                updates = []
+        if updates:
+            changed += db[collection].bulk_write(updates, ordered=False).modified_count
+        click.echo(f'{collection}: оновлено документів {changed}')
+
+
+class RefLoader:
+    # Identity map документів за _id: кожна колекція вичитується одним запитом $in,
+    # а вже знайдені документи більше не запитуються до кінця HTTP-запиту
+    def __init__(self, database, deadline=None):
+        self.db = database
+        self.docs = {}
+        # Момент time.monotonic(), після якого сервер має перервати запити (maxTimeMS)
+        self.deadline = deadline
+
+    def load(self, collection, ref_ids):
+        cache = self.docs.setdefault(collection, {})
+        missing = {oid for oid in map(to_object_id, ref_ids) if oid is not None and oid not in cache}
+        if missing:
+            cursor = self.db[collection].find({'_id': {'$in': list(missing)}})
+            if self.deadline is not None:
+                cursor = cursor.max_time_ms(time_left_ms(self.deadline))
+            for doc in cursor:
+                cache[doc['_id']] = doc
+            # Відсутні документи теж запам'ятовуємо, щоб не шукати їх повторно
+            for oid in missing:
+                cache.setdefault(oid, None)
+        return cache
+
+    def get(self, collection, ref_id):
+        oid = to_object_id(ref_id)
+        if oid is None:
+            return None
+        return self.load(collection, [oid]).get(oid)
+
+    def attach(self, documents, field, collection, target, default='Не вказано'):
+        cache = self.load(collection, [doc.get(field) for doc in documents])
+        for doc in documents:
+            ref = cache.get(to_object_id(doc.get(field)))
+            doc[target] = ref['name'] if ref else default
+        return documents
+
+
+def time_left_ms(deadline):
+    # Щонайменше 1 мс: maxTimeMS=0 означає «без обмеження»
+    return max(1, int((deadline - time.monotonic()) * 1000))
+
+
+def get_loader():
+    if 'ref_loader' not in g:
+        g.ref_loader = RefLoader(db)
+    return g.ref_loader
+
+
+# Довідники для випадаючих списків: колекція -> поля, які потрібні формам і звітам
+REF_COLLECTIONS = {
+    'trade_points': {'name': 1, 'type': 1, 'rent_payments': 1, 'utility_payments': 1},
+    'sellers': {'name': 1},
+    'products': {'name': 1},
+    'customers': {'name': 1},
+    'suppliers': {'name': 1}
+}
+
+
+class RefCache:
+    # Кеш довідників у пам'яті процесу. Запис живе не довше ttl секунд, кількість записів
+    # обмежена max_entries (LRU), а лічильник версій у колекції cache_versions
+    # скидає застарілі записи в усіх процесах після зміни довідника
+    def __init__(self, database, ttl, max_entries):
+        self.db = database
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def versions(self):
+        # Версії читаються один раз за HTTP-запит
+        if 'ref_versions' not in g:
+            g.ref_versions = {doc['_id']: doc['version'] for doc in self.db.cache_versions.find()}
+        return g.ref_versions
+
+    def docs(self, collection):
+        # Версію читаємо до документів: зміна, що відбудеться між ними, підніме версію ще раз
+        version = self.versions().get(collection, 0)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(collection)
+            if entry and entry['version'] == version and now - entry['loaded_at'] < self.ttl:
+                self.entries.move_to_end(collection)
+                return self.copy(entry['docs'])
+        docs = list(self.db[collection].find({}, REF_COLLECTIONS[collection]))
+        with self.lock:
+            self.entries[collection] = {'version': version, 'loaded_at': now, 'docs': docs}
+            self.entries.move_to_end(collection)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return self.copy(docs)
+
+    @staticmethod
+    def copy(docs):
+        # Кеш спільний для всіх запитів процесу: виклик отримує власний список і власні документи,
+        # тож може додавати до них поля (напр. trade_point_name). Вкладені значення змінювати не можна
+        return [dict(doc) for doc in docs]
+
+    def choices(self, collection):
+        return [(str(doc['_id']), doc['name']) for doc in self.docs(collection)]
+
+    def get(self, collection, ref_id):
+        oid = to_object_id(ref_id)
+        return next((doc for doc in self.docs(collection) if doc['_id'] == oid), None)
+
+    def invalidate(self, collection):
+        version = self.db.cache_versions.find_one_and_update(
+            {'_id': collection}, {'$inc': {'version': 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )['version']
+        with self.lock:
+            self.entries.pop(collection, None)
+        if 'ref_versions' in g:
+            g.ref_versions[collection] = version
+
+
+ref_cache = RefCache(db, app.config['REF_CACHE_TTL'], app.config['REF_CACHE_MAX_ENTRIES'])
+
+
+# Посторінковий перегляд за ключем (?after=) замість skip()
+def encode_page_token(doc, sort_field):
+    return base64.urlsafe_b64encode(json_util.dumps([doc.get(sort_field), doc['_id']]).encode()).decode()
+
+
+def decode_page_token(token):
+    try:
+        value, last_id = json_util.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError):
+        return None
+    return value, last_id
+
+
+def keyset_page(collection, query, sort_field, direction=DESCENDING):
+    page_size = request.args.get('page_size', type=int) or app.config['PAGE_SIZE']
+    # limit(0) у Mongo означає «без обмеження», тож розмір сторінки завжди від 1 до MAX_PAGE_SIZE
+    page_size = max(1, min(page_size, app.config['MAX_PAGE_SIZE']))
+    token = decode_page_token(request.args['after']) if request.args.get('after') else None
+    if token:
+        value, last_id = token
+        op = '$lt' if direction == DESCENDING else '$gt'
+        clauses = [{sort_field: {op: value}}, {sort_field: value, '_id': {op: last_id}}]
+        # Порожні значення сортуються як найменші
+        if value is not None and direction == DESCENDING:
+            clauses.append({sort_field: None})
+        if value is None and direction == ASCENDING:
+            clauses.append({sort_field: {'$ne': None}})
+        query = {'$and': [query, {'$or': clauses}]}
+    docs = list(collection.find(query).sort([(sort_field, direction), ('_id', direction)]).limit(page_size + 1))
+
+    args = request.args.to_dict()
+    args.pop('after', None)
+    pager = {
+        'first_url': url_for(request.endpoint, **args) if token else None,
+        'next_url': None
+    }
+    if len(docs) > page_size:
+        docs = docs[:page_size]
+        pager['next_url'] = url_for(request.endpoint, after=encode_page_token(docs[-1], sort_field), **args)
+    return docs, pager
 
 
 # Форми
 
+class TypeaheadWidget:
+    # <select> лише з вибраними значеннями та поле пошуку, яке підвантажує варіанти
+    # з /api/typeahead/<collection> (static/js/typeahead.js) замість повного списку
+    def __call__(self, field, **kwargs):
+        kwargs.setdefault('id', field.id)
+        selected = field.selected_ids()
+        refs = get_loader().load(field.collection, selected)
+        # Одиночне поле показує назву вибраного документа; очищення поля пошуку скидає вибір
+        value = ''
+        if not field.multiple and selected and refs.get(to_object_id(selected[0])):
+            value = refs[to_object_id(selected[0])]['name']
+        search = html_params(type='search', class_=kwargs.get('class', 'form-control'), autocomplete='off',
+                             placeholder='Почніть вводити назву...', value=value,
+                             data_typeahead=url_for('typeahead', collection=field.collection), data_target=kwargs['id'])
+        options = ''.join(
+            f'<option {html_params(value=value, selected=True)}>{escape(refs[to_object_id(value)]["name"])}</option>'
+            for value in selected if refs.get(to_object_id(value))
+        )
+        select = html_params(name=field.name, multiple=field.multiple, **kwargs)
+        return Markup(f'<input {search}><select {select}>{options}</select>')
+
+
+class TypeaheadMixin:
+    widget = TypeaheadWidget()
+    multiple = False
+
+    def pre_validate(self, form):
+        # Варіантів у формі немає, тож перевіряємо, що вибрані документи існують
+        selected = self.selected_ids()
+        refs = get_loader().load(self.collection, selected)
+        if any(refs.get(to_object_id(value)) is None for value in selected):
+            raise ValidationError('Значення не знайдено.')
+
+
+class TypeaheadField(TypeaheadMixin, SelectField):
+    def __init__(self, label=None, validators=None, collection=None, **kwargs):
+        super().__init__(label, validators, coerce=str, validate_choice=False, **kwargs)
+        self.collection = collection
+
+    def selected_ids(self):
+        return [self.data] if self.data else []
+
+
+class TypeaheadMultipleField(TypeaheadMixin, SelectMultipleField):
+    multiple = True
+
+    def __init__(self, label=None, validators=None, collection=None, **kwargs):
+        super().__init__(label, validators, coerce=str, validate_choice=False, **kwargs)
+        self.collection = collection
+
+    def selected_ids(self):
+        return self.data or []
+
 class SupplierOrderItemForm(FlaskForm):
     product_id = StringField('ID товару', validators=[DataRequired()])
     product_name = StringField('Назва товару', validators=[DataRequired()])
@@ -116,7 +790,7 @@ class SupplierForm(FlaskForm):
 class ProductForm(FlaskForm):
     name = StringField('Name', validators=[DataRequired()])
     description = StringField('Description')
-    suppliers = SelectMultipleField('Suppliers', choices=[], coerce=str)
+    suppliers = TypeaheadMultipleField('Suppliers', collection='suppliers')
     amount = DecimalField('Price', validators=[DataRequired()])
     currency = StringField('Currency', default="USD")
 
@@ -128,7 +802,7 @@ class CustomerForm(FlaskForm):
 
 
 class RequestItemForm(FlaskForm):
-    product_id = SelectField('Товар', coerce=str, validators=[DataRequired()])
+    product_id = TypeaheadField('Товар', collection='products', validators=[DataRequired()])
     quantity = IntegerField('Кількість', validators=[DataRequired()])
 
 
@@ -207,7 +881,11 @@ def register():
             'password': password_hash,
             'role': form.role.data
         }
-        db.users.insert_one(new_user)
+        try:
+            db.users.insert_one(new_user)
+        except DuplicateKeyError:
+            flash('Користувач з таким логіном вже існує.', 'warning')
+            return redirect(url_for('register'))
         flash('Реєстрація успішна! Тепер ви можете увійти в систему.', 'success')
         return redirect(url_for('login'))
     return render_template('register.html', form=form)
@@ -260,7 +938,12 @@ def edit_user(user_id):
         }
         if form.password.data:
             update_data['password'] = generate_password_hash(form.password.data)
-        db.users.update_one({'_id': ObjectId(user_id)}, {'$set': update_data})
+        try:
+            db.users.update_one({'_id': ObjectId(user_id)}, {'$set': update_data})
+        except DuplicateKeyError:
+            flash('Користувач з таким логіном вже існує.', 'warning')
+            return redirect(url_for('edit_user', user_id=user_id))
+        user_cache.invalidate(user_id)
         flash('Користувача успішно оновлено.', 'success')
         return redirect(url_for('user_management'))
     return render_template('register.html', form=form, form_type='edit')
@@ -276,10 +959,156 @@ def delete_user(user_id):
         flash('Ви не можете видалити свій власний акаунт.', 'danger')
         return redirect(url_for('user_management'))
     db.users.delete_one({'_id': ObjectId(user_id)})
+    user_cache.invalidate(user_id)
     flash('Користувача видалено.', 'success')
     return redirect(url_for('user_management'))
 
 
+@app.route('/users/cache_stats')
+@login_required
+def user_cache_stats():
+    if current_user.role not in ['owner', 'admin']:
+        flash('У вас немає прав доступу до цієї сторінки.', 'danger')
+        return redirect(url_for('access_denied'))
+    return jsonify(user_cache.stats())
+
+
+# Залишки товарів: один документ на пару (торговельна точка, товар)
+# Кожна зміна залишку також дописується в журнал руху товарів stock_movements
+# (kind: 'receipt' — поставка, 'sale' — продаж, 'adjustment' — коригування)
+
+
+def stock_movement(trade_point_id, product_id, delta, kind, ref_id=None):
+    return {
+        'trade_point_id': to_object_id(trade_point_id),
+        'product_id': to_object_id(product_id),
+        'quantity': delta,
+        'kind': kind,
+        'ref_id': ref_id,
+        'at': datetime.datetime.now()
+    }
+
+
+def transactions_supported():
+    # None у конфігурації — визначити за першим запитом (транзакції потребують replica set або mongos)
+    if app.config['MONGO_TRANSACTIONS'] is None:
+        hello = client.admin.command('hello')
+        app.config['MONGO_TRANSACTIONS'] = bool(hello.get('setName') or hello.get('msg') == 'isdbgrid')
+    return app.config['MONGO_TRANSACTIONS']
+
+
+def run_in_transaction(callback):
+    if not transactions_supported():
+        return callback(None)
+    with client.start_session() as session:
+        return session.with_transaction(callback)
+
+
+def change_stock(trade_point_id, product_id, delta, kind, ref_id=None):
+    # Залишок і запис у журналі змінюються разом
+    def write(session):
+        result = db.stock.update_one(
+            {'trade_point_id': to_object_id(trade_point_id), 'product_id': to_object_id(product_id)},
+            {'$inc': {'quantity': delta}},
+            upsert=True, session=session
+        )
+        db.stock_movements.insert_one(stock_movement(trade_point_id, product_id, delta, kind, ref_id),
+                                      session=session)
+        return result
+
+    return run_in_transaction(write)
+
+
+def stock_as_of(trade_point_id, moment):
+    # Найближчий знімок до моменту плюс короткий хвіст рухів після нього
+    trade_point_id = to_object_id(trade_point_id)
+    snapshot = db.stock_snapshots.find_one({'trade_point_id': trade_point_id, 'taken_at': {'$lte': moment}},
+                                           sort=[('taken_at', DESCENDING)])
+    quantities = {}
+    period = {'$lte': moment}
+    if snapshot:
+        quantities = {item['product_id']: item['quantity'] for item in snapshot['items']}
+        period['$gt'] = snapshot['taken_at']
+    for row in db.stock_movements.aggregate([
+        {'$match': {'trade_point_id': trade_point_id, 'at': period}},
+        {'$group': {'_id': '$product_id', 'quantity': {'$sum': '$quantity'}}}
+    ]):
+        quantities[row['_id']] = quantities.get(row['_id'], 0) + row['quantity']
+    return quantities
+
+
+def stock_history_start(trade_point_id):
+    # Найраніший момент, з якого залишки точки відомі: перший знімок або перший рух товару
+    trade_point_id = to_object_id(trade_point_id)
+    moments = [
+        doc[field] for doc, field in (
+            (db.stock_snapshots.find_one({'trade_point_id': trade_point_id}, {'taken_at': 1},
+                                         sort=[('taken_at', ASCENDING)]), 'taken_at'),
+            (db.stock_movements.find_one({'trade_point_id': trade_point_id}, {'at': 1},
+                                         sort=[('at', ASCENDING)]), 'at')
+        ) if doc
+    ]
+    return min(moments) if moments else None
+
+
+@app.cli.command('snapshot-stock')
+def snapshot_stock():
+    """Зберегти знімок залишків кожної торговельної точки (запускати періодично, напр. щодня)."""
+    ensure_indexes('stock_movements', 'stock_snapshots')
+    taken_at = datetime.datetime.now()
+    for trade_point in db.trade_points.find({}, {'_id': 1}):
+        if db.stock_snapshots.find_one({'trade_point_id': trade_point['_id']}, {'_id': 1}):
+            quantities = stock_as_of(trade_point['_id'], taken_at)
+        else:
+            # Перший знімок — початкові залишки з колекції stock
+            quantities = {row['product_id']: row['quantity']
+                          for row in db.stock.find({'trade_point_id': trade_point['_id']})}
+        db.stock_snapshots.insert_one({
+            'trade_point_id': trade_point['_id'],
+            'taken_at': taken_at,
+            'items': [{'product_id': product_id, 'quantity': quantity} for product_id, quantity in quantities.items()]
+        })
+    click.echo(f'Знімок залишків збережено на {taken_at:%Y-%m-%d %H:%M}')
+
+
+@app.cli.command('migrate-stock')
+def migrate_stock():
+    """Перенести залишки з trade_points.inventory у колекцію stock.
+
+    Можна запускати й після розгортання: inventory додається до рядків stock через $inc,
+    тож зміни, які change_stock уже записав у stock, зберігаються.
+    """
+    ensure_indexes('stock')
+    moved = 0
+    for trade_point in db.trade_points.find({'inventory': {'$exists': True}}, {'_id': 1}):
+        # Спочатку забрати inventory з документа: повторний запуск не додасть ті самі залишки вдруге
+        trade_point = db.trade_points.find_one_and_update(
+            {'_id': trade_point['_id'], 'inventory': {'$exists': True}},
+            {'$unset': {'inventory': ''}},
+            projection={'inventory': 1}
+        )
+        if not trade_point:
+            continue
+        rows = [
+            UpdateOne({'trade_point_id': trade_point['_id'], 'product_id': to_object_id(product_id)},
+                      {'$inc': {'quantity': quantity}}, upsert=True)
+            for product_id, quantity in (trade_point.get('inventory') or {}).items()
+        ]
+        if rows:
+            db.stock.bulk_write(rows, ordered=False)
+            # Початковий залишок потрапляє й у журнал руху — раніше за будь-який рух, записаний до міграції,
+            # щоб stock_as_of і сума журналу сходилися з колекцією stock
+            earliest = db.stock_movements.find_one({'trade_point_id': trade_point['_id']}, {'at': 1},
+                                                   sort=[('at', ASCENDING)])
+            opened_at = min(earliest['at'], datetime.datetime.now()) if earliest else datetime.datetime.now()
+            db.stock_movements.insert_many([
+                dict(stock_movement(trade_point['_id'], product_id, quantity, 'adjustment'), at=opened_at)
+                for product_id, quantity in trade_point['inventory'].items()
+            ])
+        moved += len(rows)
+    click.echo(f'Перенесено залишків: {moved}')
+
+
 # Маршрути для торговельних точок
 @app.route('/trade_points')
 @login_required
@@ -297,9 +1126,7 @@ def supplier_orders_receive_list():
     # Отримуємо список замовлень, які ще не були отримані
     supplier_orders = list(db.supplier_orders.find({'received': {'$ne': True}}))
     # Додаємо інформацію про постачальника
-    for order in supplier_orders:
-        supplier = db.suppliers.find_one({'_id': ObjectId(order['supplier_id'])})
-        order['supplier_name'] = supplier['name'] if supplier else 'Невідомий постачальник'
+    get_loader().attach(supplier_orders, 'supplier_id', 'suppliers', 'supplier_name', 'Невідомий постачальник')
     return render_template('supplier_orders/receive_list.html', supplier_orders=supplier_orders)
 
 
@@ -324,6 +1151,7 @@ def add_trade_point():
             'products': []
         }
         db.trade_points.insert_one(trade_point)
+        ref_cache.invalidate('trade_points')
         flash('Торговельну точку успішно додано.', 'success')
         return redirect(url_for('trade_points'))
     return render_template('trade_points/trade_point_form.html', form=form, form_type='add')
@@ -361,6 +1189,7 @@ def edit_trade_point(trade_point_id):
             'sections': [section.strip() for section in form.sections.data.split(',')] if form.sections.data else []
         }
         db.trade_points.update_one({'_id': ObjectId(trade_point_id)}, {'$set': updated_data})
+        ref_cache.invalidate('trade_points')
         flash('Торговельну точку успішно оновлено.', 'success')
         return redirect(url_for('trade_points'))
     return render_template('trade_points/trade_point_form.html', form=form, form_type='edit')
@@ -373,6 +1202,8 @@ def delete_trade_point(trade_point_id):
         flash('У вас немає прав доступу до цієї сторінки.', 'danger')
         return redirect(url_for('access_denied'))
     db.trade_points.delete_one({'_id': ObjectId(trade_point_id)})
+    db.stock.delete_many({'trade_point_id': ObjectId(trade_point_id)})
+    ref_cache.invalidate('trade_points')
     flash('Торговельну точку видалено.', 'success')
     return redirect(url_for('trade_points'))
 
@@ -383,9 +1214,7 @@ def delete_trade_point(trade_point_id):
 def sellers():
     sellers = list(db.sellers.find())
     # Додати ім'я торговельної точки до кожного продавця
-    for seller in sellers:
-        trade_point = db.trade_points.find_one({'_id': ObjectId(seller['trade_point_id'])})
-        seller['trade_point_name'] = trade_point['name'] if trade_point else 'Не вказано'
+    get_loader().attach(sellers, 'trade_point_id', 'trade_points', 'trade_point_name')
     return render_template('sellers/sellers.html', sellers=sellers)
 
 
@@ -409,15 +1238,15 @@ def add_seller():
         return redirect(url_for('access_denied'))
     form = SellerForm()
     # Заповнити вибір торговельних точок
-    trade_points = list(db.trade_points.find())
-    form.trade_point_id.choices = [(str(tp['_id']), tp['name']) for tp in trade_points]
+    form.trade_point_id.choices = ref_cache.choices('trade_points')
     if form.validate_on_submit():
-        seller = {
+        seller = normalize('sellers', {
             'name': form.name.data,
             'trade_point_id': form.trade_point_id.data,
             'salary': form.salary.data
-        }
+        })
         db.sellers.insert_one(seller)
+        ref_cache.invalidate('sellers')
         # Додати продавця до торговельної точки
         db.trade_points.update_one({'_id': ObjectId(form.trade_point_id.data)}, {'$push': {'sellers': seller['_id']}})
         flash('Продавця успішно додано.', 'success')
@@ -437,27 +1266,27 @@ def edit_seller(seller_id):
         return redirect(url_for('sellers'))
     form = SellerForm(data={
         'name': seller['name'],
-        'trade_point_id': seller['trade_point_id'],
+        'trade_point_id': str(seller['trade_point_id']),
         'salary': seller['salary']
     })
     # Заповнити вибір торговельних точок
-    trade_points = list(db.trade_points.find())
-    form.trade_point_id.choices = [(str(tp['_id']), tp['name']) for tp in trade_points]
+    form.trade_point_id.choices = ref_cache.choices('trade_points')
     if form.validate_on_submit():
         # Якщо торговельна точка змінилася, оновити посилання
-        if form.trade_point_id.data != seller['trade_point_id']:
+        if to_object_id(form.trade_point_id.data) != to_object_id(seller['trade_point_id']):
             # Видалити продавця з попередньої торговельної точки
             db.trade_points.update_one({'_id': ObjectId(seller['trade_point_id'])},
                                        {'$pull': {'sellers': seller['_id']}})
             # Додати продавця до нової торговельної точки
             db.trade_points.update_one({'_id': ObjectId(form.trade_point_id.data)},
                                        {'$push': {'sellers': seller['_id']}})
-        updated_data = {
+        updated_data = normalize('sellers', {
             'name': form.name.data,
             'trade_point_id': form.trade_point_id.data,
             'salary': form.salary.data
-        }
+        })
         db.sellers.update_one({'_id': ObjectId(seller_id)}, {'$set': updated_data})
+        ref_cache.invalidate('sellers')
         flash('Продавця успішно оновлено.', 'success')
         return redirect(url_for('sellers'))
     return render_template('sellers/seller_form.html', form=form, form_type='edit')
@@ -476,6 +1305,7 @@ def delete_seller(seller_id):
     # Видалити продавця з торговельної точки
     db.trade_points.update_one({'_id': ObjectId(seller['trade_point_id'])}, {'$pull': {'sellers': seller['_id']}})
     db.sellers.delete_one({'_id': ObjectId(seller_id)})
+    ref_cache.invalidate('sellers')
     flash('Продавця видалено.', 'success')
     return redirect(url_for('sellers'))
 
@@ -484,12 +1314,13 @@ def delete_seller(seller_id):
 @app.route('/products')
 @login_required
 def products():
-    products = list(db.products.find())
+    products, pager = keyset_page(db.products, {}, 'name', ASCENDING)
     # Додати імена постачальників до кожного товару
+    suppliers = get_loader().load('suppliers', [sid for product in products for sid in product.get('suppliers', [])])
     for product in products:
-        suppliers = list(db.suppliers.find({'_id': {'$in': [ObjectId(sid) for sid in product.get('suppliers', [])]}}))
-        product['supplier_names'] = [supplier['name'] for supplier in suppliers]
-    return render_template('products/products.html', products=products)
+        product['supplier_names'] = [suppliers[to_object_id(sid)]['name'] for sid in product.get('suppliers', [])
+                                     if suppliers.get(to_object_id(sid))]
+    return render_template('products/products.html', products=products, pager=pager)
 
 
 @app.route('/products/<product_id>')
@@ -506,9 +1337,9 @@ def view_product(product_id):
 
     # Retrieve quantities of the product at each trade point
     quantities = []
-    trade_points = list(db.trade_points.find())
-    for trade_point in trade_points:
-        quantity = trade_point.get('inventory', {}).get(str(product['_id']), 0)  # Convert ObjectId to string
+    stock = {row['trade_point_id']: row['quantity'] for row in db.stock.find({'product_id': product['_id']})}
+    for trade_point in ref_cache.docs('trade_points'):
+        quantity = stock.get(trade_point['_id'], 0)
         quantities.append({
             'trade_point_name': trade_point['name'],
             'amount': quantity
@@ -525,9 +1356,6 @@ def add_product():
         return redirect(url_for('access_denied'))
 
     form = ProductForm()
-    # Populate suppliers choices
-    suppliers = list(db.suppliers.find())
-    form.suppliers.choices = [(str(supplier['_id']), supplier['name']) for supplier in suppliers]
 
     if form.validate_on_submit():
         # Convert amount from Decimal to float
@@ -537,6 +1365,7 @@ def add_product():
         product = {
             'name': form.name.data,
             'description': form.description.data,
+            'suppliers': form.suppliers.data,
             'prices': [{
                 'amount': price_amount,
                 'currency': form.currency.data
@@ -544,7 +1373,8 @@ def add_product():
         }
 
         # Insert the product into the database
-        db.products.insert_one(product)
+        db.products.insert_one(normalize('products', product))
+        ref_cache.invalidate('products')
         flash('Товар успішно додано.', 'success')
         return redirect(url_for('products'))
 
@@ -574,10 +1404,6 @@ def edit_product(product_id):
         'currency': product['prices'][0]['currency'] if product['prices'] else 'USD'
     })
 
-    # Populate supplier choices
-    suppliers = list(db.suppliers.find())
-    form.suppliers.choices = [(str(supplier['_id']), supplier['name']) for supplier in suppliers]
-
     if form.validate_on_submit():
         # Prepare updated data
         updated_data = {
@@ -590,7 +1416,8 @@ def edit_product(product_id):
             }]
         }
         # Update the product in the database
-        db.products.update_one({'_id': ObjectId(product_id)}, {'$set': updated_data})
+        db.products.update_one({'_id': ObjectId(product_id)}, {'$set': normalize('products', updated_data)})
+        ref_cache.invalidate('products')
         flash('Товар успішно оновлено.', 'success')
         return redirect(url_for('view_product', product_id=product_id))
 
@@ -604,6 +1431,8 @@ def delete_product(product_id):
         flash('У вас немає прав доступу до цієї сторінки.', 'danger')
         return redirect(url_for('access_denied'))
     db.products.delete_one({'_id': ObjectId(product_id)})
+    db.stock.delete_many({'product_id': ObjectId(product_id)})
+    ref_cache.invalidate('products')
     flash('Товар видалено.', 'success')
     return redirect(url_for('products'))
 
@@ -624,7 +1453,7 @@ def view_supplier(supplier_id):
         flash('Постачальника не знайдено.', 'danger')
         return redirect(url_for('suppliers'))
     # Отримати товари, які постачає постачальник
-    products = list(db.products.find({'suppliers': supplier_id}))
+    products = list(db.products.find({'suppliers': ObjectId(supplier_id)}))
     return render_template('suppliers/supplier_detail.html', supplier=supplier, products=products)
 
 
@@ -641,6 +1470,7 @@ def add_supplier():
             'contact_info': form.contact_info.data
         }
         db.suppliers.insert_one(supplier)
+        ref_cache.invalidate('suppliers')
         flash('Постачальника успішно додано.', 'success')
         return redirect(url_for('suppliers'))
     return render_template('suppliers/supplier_form.html', form=form, form_type='add')
@@ -666,6 +1496,7 @@ def edit_supplier(supplier_id):
             'contact_info': form.contact_info.data
         }
         db.suppliers.update_one({'_id': ObjectId(supplier_id)}, {'$set': updated_data})
+        ref_cache.invalidate('suppliers')
         flash('Постачальника успішно оновлено.', 'success')
         return redirect(url_for('suppliers'))
     return render_template('suppliers/supplier_form.html', form=form, form_type='edit')
@@ -678,6 +1509,7 @@ def delete_supplier(supplier_id):
         flash('У вас немає прав доступу до цієї сторінки.', 'danger')
         return redirect(url_for('access_denied'))
     db.suppliers.delete_one({'_id': ObjectId(supplier_id)})
+    ref_cache.invalidate('suppliers')
     flash('Постачальника видалено.', 'success')
     return redirect(url_for('suppliers'))
 
@@ -688,9 +1520,7 @@ def delete_supplier(supplier_id):
 def supplier_orders():
     # Retrieve only orders where 'received' is either missing or set to False
     orders = list(db.supplier_orders.find({"$or": [{"received": {"$exists": False}}, {"received": False}]}))
-    for order in orders:
-        supplier = db.suppliers.find_one({'_id': ObjectId(order['supplier_id'])})
-        order['supplier_name'] = supplier['name'] if supplier else 'Не вказано'
+    get_loader().attach(orders, 'supplier_id', 'suppliers', 'supplier_name')
     return render_template('supplier_orders/supplier_orders.html', supplier_orders=orders)
 
 
@@ -726,19 +1556,17 @@ def edit_supplier_order(order_id):
         return redirect(url_for('supplier_orders'))
     form = SupplierOrderForm()
     # Заповнити вибір постачальників
-    suppliers = list(db.suppliers.find())
-    form.supplier_id.choices = [(str(supplier['_id']), supplier['name']) for supplier in suppliers]
+    form.supplier_id.choices = ref_cache.choices('suppliers')
     # Заповнити вибір товарів
-    products = list(db.products.find())
-    product_choices = [(str(product['_id']), product['name']) for product in products]
+    product_choices = ref_cache.choices('products')
     if request.method == 'GET':
-        form.supplier_id.data = order['supplier_id']
-        form.order_date.data = order['order_date']
+        form.supplier_id.data = str(order['supplier_id'])
+        form.order_date.data = to_datetime(order['order_date'])
         form.products_ordered.entries = []
         for item in order.get('products_ordered', []):
             item_form = SupplierOrderItemForm()
             item_form.product_id.choices = product_choices
-            item_form.product_id.data = item['product_id']
+            item_form.product_id.data = str(item['product_id'])
             item_form.quantity.data = item['quantity']
             form.products_ordered.append_entry(item_form.data)
     else:
@@ -756,7 +1584,7 @@ def edit_supplier_order(order_id):
             'order_date': form.order_date.data,
             'products_ordered': products_ordered
         }
-        db.supplier_orders.update_one({'_id': ObjectId(order_id)}, {'$set': updated_data})
+        db.supplier_orders.update_one({'_id': ObjectId(order_id)}, {'$set': normalize('supplier_orders', updated_data)})
         flash('Замовлення успішно оновлено.', 'success')
         return redirect(url_for('supplier_orders'))
     return render_template('supplier_orders/supplier_order_form.html', form=form, form_type='edit')
@@ -782,88 +1610,118 @@ class SalesFilterForm(FlaskForm):
 @app.route('/suppliers_for_product', methods=['GET', 'POST'])
 @login_required
 def suppliers_for_product():
-    products = list(db.products.find())
+    products = ref_cache.docs('products')
     suppliers = []
 
     if request.method == 'POST':
         product_id = request.form.get('product')
         min_quantity = int(request.form.get('min_quantity', 0))
 
-        # Dictionary to accumulate total quantities per supplier
-        supplier_quantities = {}
+        # Sum received quantities per supplier from the supply ledger and join supplier names
+        suppliers = list(db.supplies.aggregate([
+            {"$match": {"product_id": ObjectId(product_id)}},
+            {"$group": {"_id": "$supplier_id", "quantity": {"$sum": "$quantity"}}},
+            {"$match": {"quantity": {"$gte": min_quantity}}},
+            {"$lookup": {"from": "suppliers", "localField": "_id", "foreignField": "_id", "as": "supplier"}},
+            {"$unwind": "$supplier"},
+            {"$sort": {"quantity": -1}},
+            {"$project": {"_id": 0, "name": "$supplier.name", "quantity": 1}}
+        ]))
 
-        # Find supplier orders that include the specified product and are marked as received
-        supplier_orders = db.supplier_orders.find({
-            "received": True,
-            "related_requests": {"$exists": True, "$ne": []}  # Ensure related_requests is not empty
-        })
+    return render_template('queries/suppliers_for_product.html', products=products, suppliers=suppliers)
 
-        # Process each supplier order
-        for order in supplier_orders:
-            supplier_id = order["supplier_id"]
-
-            # Navigate to each request linked in related_requests
-            for request_id in order["related_requests"]:
-                request_item = db.requests.find_one({"_id": request_id})
-                if request_item:
-                    # Find the product in products_requested within the request
-                    for product_request in request_item.get("products_requested", []):
-                        if product_request["product_id"] == ObjectId(product_id):
-                            quantity = int(product_request["quantity"])
-                            # Accumulate quantity for the supplier
-                            supplier_quantities[supplier_id] = supplier_quantities.get(supplier_id, 0) + quantity
-
-        # Filter suppliers based on min_quantity and retrieve supplier details
-        for supplier_id, total_quantity in supplier_quantities.items():
-            if total_quantity >= min_quantity:
-                supplier = db.suppliers.find_one({"_id": supplier_id})
-                if supplier:
-                    suppliers.append({
-                        "name": supplier["name"],
-                        "quantity": total_quantity
-                    })
+# Щоденний підсумок продажів: день × торговельна точка × товар × продавець
+def sale_rollup_key(sale):
+    sale_date = to_datetime(sale.get('date'))
+    return {
+        'day': datetime.datetime.combine(sale_date.date(), datetime.time()) if sale_date else None,
+        'trade_point_id': to_object_id(sale.get('trade_point_id')),
+        'product_id': to_object_id(sale.get('product_id')),
+        'seller_id': to_object_id(sale.get('seller_id'))
+    }
+
+
+def apply_sale_to_rollup(sale, sign=1, session=None):
+    quantity = sale.get('quantity') or 0
+    price = float(sale.get('price') or 0)
+    key = sale_rollup_key(sale)
+    db.sales_daily.update_one(
+        key,
+        {'$inc': {'quantity': sign * quantity, 'revenue': sign * quantity * price, 'sale_count': sign}},
+        upsert=True,
+        session=session
+    )
+    if sign < 0:
+        # Рядок без жодного продажу не повинен потрапляти у звіти
+        db.sales_daily.delete_one(dict(key, sale_count={'$lte': 0}), session=session)
+
+
+@app.cli.command('rebuild-sales-daily')
+def rebuild_sales_daily():
+    """Перерахувати колекцію sales_daily з усіх продажів.
+
+    Запускати, коли продажі не записуються: зміни sales_daily, зроблені під час перерахунку,
+    буде втрачено при заміні колекції.
+    """
+    rebuild_sales_rollup()
+    click.echo(f'Рядків у sales_daily: {db.sales_daily.count_documents({})}')
+
+
+def rebuild_sales_rollup():
+    db.sales.aggregate([
+        {"$group": {
+            "_id": {
+                "day": {"$dateTrunc": {"date": {"$toDate": "$date"}, "unit": "day"}},
+                "trade_point_id": {"$toObjectId": "$trade_point_id"},
+                "product_id": {"$toObjectId": "$product_id"},
+                "seller_id": {"$toObjectId": "$seller_id"}
+            },
+            "quantity": {"$sum": "$quantity"},
+            "revenue": {"$sum": {"$multiply": ["$quantity", "$price"]}},
+            "sale_count": {"$sum": 1}
+        }},
+        {"$replaceWith": {"$mergeObjects": ["$_id", {
+            "quantity": "$quantity",
+            "revenue": "$revenue",
+            "sale_count": "$sale_count"
+        }]}},
+        {"$out": "sales_daily_rebuild"}
+    ])
+    # Читачі бачать стару колекцію, доки нова не готова разом з індексами, а потім заміна атомарна
+    db.sales_daily_rebuild.create_indexes(INDEXES['sales_daily'])
+    db.sales_daily_rebuild.rename('sales_daily', dropTarget=True)
 
-    return render_template('queries/suppliers_for_product.html', products=products, suppliers=suppliers)
 
 # Маршрути для продажів
 @app.route('/sales', methods=['GET', 'POST'])
 @login_required
 def sales():
     filter_form = SalesFilterForm(request.args)
+    loader = get_loader()
 
     # Заповнюємо вибір торговельних точок
-    trade_points = list(db.trade_points.find())
-    filter_form.trade_point_id.choices = [('', 'Всі торговельні точки')] + [(str(tp['_id']), tp['name']) for tp in
-                                                                            trade_points]
+    filter_form.trade_point_id.choices = [('', 'Всі торговельні точки')] + ref_cache.choices('trade_points')
 
     # Заповнюємо вибір продавців
-    sellers = list(db.sellers.find())
-    filter_form.seller_id.choices = [('', 'Всі продавці')] + [(str(seller['_id']), seller['name']) for seller in
-                                                              sellers]
+    filter_form.seller_id.choices = [('', 'Всі продавці')] + ref_cache.choices('sellers')
 
     # Формуємо запит до бази даних з урахуванням фільтрів
     query = {}
     if filter_form.validate():
         if filter_form.trade_point_id.data:
-            query['trade_point_id'] = filter_form.trade_point_id.data
+            query['trade_point_id'] = to_object_id(filter_form.trade_point_id.data)
         if filter_form.seller_id.data:
-            query['seller_id'] = filter_form.seller_id.data
+            query['seller_id'] = to_object_id(filter_form.seller_id.data)
 
-    sales = list(db.sales.find(query))
+    sales, pager = keyset_page(db.sales, query, 'date')
 
-    # Додаємо додаткову інформацію про продажі
-    for sale in sales:
-        seller = db.sellers.find_one({'_id': ObjectId(sale['seller_id'])})
-        sale['seller_name'] = seller['name'] if seller else 'Не вказано'
-        trade_point = db.trade_points.find_one({'_id': ObjectId(sale['trade_point_id'])})
-        sale['trade_point_name'] = trade_point['name'] if trade_point else 'Не вказано'
-        product = db.products.find_one({'_id': ObjectId(sale['product_id'])})
-        sale['product_name'] = product['name'] if product else 'Не вказано'
-        if 'customer_id' in sale and sale['customer_id']:
-            customer = db.customers.find_one({'_id': ObjectId(sale['customer_id'])})
-            sale['customer_name'] = customer['name'] if customer else 'Не вказано'
+    # Додаємо додаткову інформацію про продажі (по одному запиту $in на колекцію)
+    loader.attach(sales, 'seller_id', 'sellers', 'seller_name')
+    loader.attach(sales, 'trade_point_id', 'trade_points', 'trade_point_name')
+    loader.attach(sales, 'product_id', 'products', 'product_name')
+    loader.attach([sale for sale in sales if sale.get('customer_id')], 'customer_id', 'customers', 'customer_name')
 
-    return render_template('sales/sales.html', sales=sales, filter_form=filter_form)
+    return render_template('sales/sales.html', sales=sales, filter_form=filter_form, pager=pager)
 
 
 @app.route('/sales/<sale_id>')
@@ -873,10 +1731,11 @@ def view_sale(sale_id):
     if not sale:
         flash('Продаж не знайдено.', 'danger')
         return redirect(url_for('sales'))
-    seller = db.sellers.find_one({'_id': ObjectId(sale['seller_id'])})
-    trade_point = db.trade_points.find_one({'_id': ObjectId(sale['trade_point_id'])})
-    product = db.products.find_one({'_id': ObjectId(sale['product_id'])})
-    customer = db.customers.find_one({'_id': ObjectId(sale['customer_id'])}) if sale.get('customer_id') else None
+    loader = get_loader()
+    seller = loader.get('sellers', sale['seller_id'])
+    trade_point = loader.get('trade_points', sale['trade_point_id'])
+    product = loader.get('products', sale['product_id'])
+    customer = loader.get('customers', sale.get('customer_id'))
     sale_details = {
         'seller_name': seller['name'] if seller else 'Не вказано',
         'trade_point_name': trade_point['name'] if trade_point else 'Не вказано',
@@ -896,31 +1755,24 @@ def add_sale():
         return redirect(url_for('access_denied'))
     form = SaleForm()
     # Заповнити вибір торговельних точок
-    trade_points = list(db.trade_points.find())
-    form.trade_point_id.choices = [(str(tp['_id']), tp['name']) for tp in trade_points]
-    # Заповнити вибір продавців (можна фільтрувати за торговельною точкою)
-    sellers = list(db.sellers.find())
-    form.seller_id.choices = [(str(seller['_id']), seller['name']) for seller in sellers]
-    # Заповнити вибір товарів
-    products = list(db.products.find())
-    form.product_id.choices = [(str(product['_id']), product['name']) for product in products]
-    # Заповнити вибір покупців
-    customers = list(db.customers.find())
-    form.customer_id.choices = [(str(customer['_id']), customer['name']) for customer in customers]
+    form.trade_point_id.choices = ref_cache.choices('trade_points')
+    # Продавці, товари та покупці обираються пошуком за назвою (TypeaheadField)
     if form.validate_on_submit():
         sale = {
             'trade_point_id': form.trade_point_id.data,
             'seller_id': form.seller_id.data,
             'product_id': form.product_id.data,
             'quantity': form.quantity.data,
-            'price': form.price.data,
+            'price': float(form.price.data),
             'date': form.date.data,
             'customer_id': form.customer_id.data if form.customer_id.data else None
         }
-        db.sales.insert_one(sale)
+        db.sales.insert_one(normalize('sales', sale))
+        apply_sale_to_rollup(sale)
         flash('Продаж успішно додано.', 'success')
         return redirect(url_for('sales'))
-    return render_template('sales/sale_form.html', form=form, form_type='add')
+    return render_template('sales/sale_form.html', form=form, form_type='add',
+                           trade_points=ref_cache.docs('trade_points'))
 
 
 @app.route('/sales/edit/<sale_id>', methods=['GET', 'POST'])
@@ -934,39 +1786,35 @@ def edit_sale(sale_id):
         flash('Продаж не знайдено.', 'danger')
         return redirect(url_for('sales'))
     form = SaleForm(data={
-        'trade_point_id': sale['trade_point_id'],
-        'seller_id': sale['seller_id'],
-        'product_id': sale['product_id'],
+        'trade_point_id': str(sale['trade_point_id']),
+        'seller_id': str(sale['seller_id']),
+        'product_id': str(sale['product_id']),
         'quantity': sale['quantity'],
         'price': sale['price'],
-        'customer_id': sale.get('customer_id', '')
+        'date': sale.get('date'),
+        'customer_id': str(sale['customer_id']) if sale.get('customer_id') else ''
     })
     # Заповнити вибір торговельних точок
-    trade_points = list(db.trade_points.find())
-    form.trade_point_id.choices = [(str(tp['_id']), tp['name']) for tp in trade_points]
-    # Заповнити вибір продавців
-    sellers = list(db.sellers.find())
-    form.seller_id.choices = [(str(seller['_id']), seller['name']) for seller in sellers]
-    # Заповнити вибір товарів
-    products = list(db.products.find())
-    form.product_id.choices = [(str(product['_id']), product['name']) for product in products]
-    # Заповнити вибір покупців
-    customers = list(db.customers.find())
-    form.customer_id.choices = [(str(customer['_id']), customer['name']) for customer in customers]
+    form.trade_point_id.choices = ref_cache.choices('trade_points')
+    # Продавці, товари та покупці обираються пошуком за назвою (TypeaheadField)
     if form.validate_on_submit():
         updated_data = {
             'trade_point_id': form.trade_point_id.data,
             'seller_id': form.seller_id.data,
             'product_id': form.product_id.data,
             'quantity': form.quantity.data,
-            'price': form.price.data,
+            'price': float(form.price.data),
             'date': form.date.data,
             'customer_id': form.customer_id.data if form.customer_id.data else None
         }
-        db.sales.update_one({'_id': ObjectId(sale_id)}, {'$set': updated_data})
+        db.sales.update_one({'_id': ObjectId(sale_id)}, {'$set': normalize('sales', updated_data)})
+        # Прибрати старий продаж з підсумків і додати оновлений
+        apply_sale_to_rollup(sale, -1)
+        apply_sale_to_rollup(updated_data)
         flash('Продаж успішно оновлено.', 'success')
         return redirect(url_for('sales'))
-    return render_template('sales/sale_form.html', form=form, form_type='edit')
+    return render_template('sales/sale_form.html', form=form, form_type='edit',
+                           trade_points=ref_cache.docs('trade_points'))
 
 
 @app.route('/sales/delete/<sale_id>')
@@ -975,7 +1823,9 @@ def delete_sale(sale_id):
     if current_user.role not in ['owner', 'admin', 'operator']:
         flash('У вас немає прав доступу до цієї сторінки.', 'danger')
         return redirect(url_for('access_denied'))
-    db.sales.delete_one({'_id': ObjectId(sale_id)})
+    sale = db.sales.find_one_and_delete({'_id': ObjectId(sale_id)})
+    if sale:
+        apply_sale_to_rollup(sale, -1)
     flash('Продаж видалено.', 'success')
     return redirect(url_for('sales'))
 
@@ -984,8 +1834,8 @@ def delete_sale(sale_id):
 @app.route('/customers')
 @login_required
 def customers():
-    customers = list(db.customers.find())
-    return render_template('customers/customers.html', customers=customers)
+    customers, pager = keyset_page(db.customers, {}, 'name', ASCENDING)
+    return render_template('customers/customers.html', customers=customers, pager=pager)
 
 
 @app.route('/customers/<customer_id>')
@@ -998,15 +1848,10 @@ def view_customer(customer_id):
 
     sales = list(db.sales.find({'customer_id': ObjectId(customer_id)}))
 
-    for sale in sales:
-        product = db.products.find_one({'_id': sale['product_id']})
-        sale['product_name'] = product['name'] if product else 'Не вказано'
-
-        trade_point = db.trade_points.find_one({'_id': sale['trade_point_id']})
-        sale['trade_point_name'] = trade_point['name'] if trade_point else 'Не вказано'
-
-        seller = db.sellers.find_one({'_id': sale['seller_id']})
-        sale['seller_name'] = seller['name'] if seller else 'Не вказано'
+    loader = get_loader()
+    loader.attach(sales, 'product_id', 'products', 'product_name')
+    loader.attach(sales, 'trade_point_id', 'trade_points', 'trade_point_name')
+    loader.attach(sales, 'seller_id', 'sellers', 'seller_name')
 
     return render_template('customers/customer_detail.html', customer=customer, sales=sales)
 
@@ -1024,6 +1869,7 @@ def add_customer():
             'characteristics': form.characteristics.data
         }
         db.customers.insert_one(customer)
+        ref_cache.invalidate('customers')
         flash('Покупця успішно додано.', 'success')
         return redirect(url_for('customers'))
     return render_template('customers/customer_form.html', form=form, form_type='add')
@@ -1049,6 +1895,7 @@ def edit_customer(customer_id):
             'characteristics': form.characteristics.data
         }
         db.customers.update_one({'_id': ObjectId(customer_id)}, {'$set': updated_data})
+        ref_cache.invalidate('customers')
         flash('Покупця успішно оновлено.', 'success')
         return redirect(url_for('customers'))
     return render_template('customers/customer_form.html', form=form, form_type='edit')
@@ -1061,6 +1908,7 @@ def delete_customer(customer_id):
         flash('У вас немає прав доступу до цієї сторінки.', 'danger')
         return redirect(url_for('access_denied'))
     db.customers.delete_one({'_id': ObjectId(customer_id)})
+    ref_cache.invalidate('customers')
     flash('Покупця видалено.', 'success')
     return redirect(url_for('customers'))
 
@@ -1069,11 +1917,9 @@ def delete_customer(customer_id):
 @app.route('/requests')
 @login_required
 def requests_route():
-    requests_list = list(db.requests.find())
-    for req in requests_list:
-        trade_point = db.trade_points.find_one({'_id': ObjectId(req['trade_point_id'])})
-        req['trade_point_name'] = trade_point['name'] if trade_point else 'Не вказано'
-    return render_template('requests/requests.html', requests=requests_list)
+    requests_list, pager = keyset_page(db.requests, {}, 'date')
+    get_loader().attach(requests_list, 'trade_point_id', 'trade_points', 'trade_point_name')
+    return render_template('requests/requests.html', requests=requests_list, pager=pager)
 
 
 @app.route('/requests/<request_id>')
@@ -1087,12 +1933,10 @@ def view_request(request_id):
     trade_point = db.trade_points.find_one({'_id': ObjectId(request_item['trade_point_id'])})
     request_item['trade_point_name'] = trade_point['name'] if trade_point else 'Не вказано'
 
-    products_requested = []
-    for item in request_item.get('products_requested', []):
-        products_requested.append({
-            'product_name': item['product_name'],
-            'quantity': item['quantity']
-        })
+    # Заявки зберігають лише product_id; назви підтягуються одним запитом $in
+    products_requested = [{'product_id': item['product_id'], 'quantity': item['quantity']}
+                          for item in request_item.get('products_requested', [])]
+    get_loader().attach(products_requested, 'product_id', 'products', 'product_name')
 
     return render_template('requests/request_detail.html', request=request_item, products_requested=products_requested)
 
@@ -1103,9 +1947,8 @@ from bson import ObjectId
 
 @app.route('/requests/add', methods=['GET', 'POST'])
 def add_request():
-    # Fetch trade points and products for dropdowns
-    trade_points = list(db.trade_points.find({}, {"_id": 1, "name": 1}))
-    products = list(db.products.find({}, {"_id": 1, "name": 1}))
+    # Fetch trade points for the dropdown; products are picked by name search
+    trade_points = ref_cache.docs('trade_points')
 
     if request.method == 'POST':
         # Get data from the form
@@ -1128,7 +1971,7 @@ def add_request():
         # Check if all required fields are provided
         if not date or not trade_point_id or not products_requested:
             flash("Всі поля повинні бути заповнені", "danger")
-            return render_template('requests/request_form.html', trade_points=trade_points, products=products)
+            return render_template('requests/request_form.html', trade_points=trade_points)
 
         # Create new request object
         new_request = {
@@ -1138,11 +1981,11 @@ def add_request():
         }
 
         # Insert into the database
-        db.requests.insert_one(new_request)
+        db.requests.insert_one(normalize('requests', new_request))
         flash('Заявку успішно додано.', 'success')
         return redirect(url_for('requests_route'))
 
-    return render_template('requests/request_form.html', trade_points=trade_points, products=products)
+    return render_template('requests/request_form.html', trade_points=trade_points)
 
 
 @app.route('/requests/edit/<request_id>', methods=['GET', 'POST'])
@@ -1157,21 +2000,14 @@ def edit_request(request_id):
         return redirect(url_for('requests_route'))
 
     form = RequestForm()
-    trade_points = list(db.trade_points.find())
-    products = list(db.products.find())
-    product_choices = [(str(product['_id']), product['name']) for product in products]
-
-    form.trade_point_id.choices = [(str(tp['_id']), tp['name']) for tp in trade_points]
+    form.trade_point_id.choices = ref_cache.choices('trade_points')
 
     if request.method == 'GET':
-        form.trade_point_id.data = request_item['trade_point_id']
-        form.date.data = request_item['date']
+        form.trade_point_id.data = str(request_item['trade_point_id'])
+        form.date.data = to_datetime(request_item['date'])
+        form.products_requested.entries = []
         for item in request_item.get('products_requested', []):
-            item_form = RequestItemForm()
-            item_form.product_id.choices = product_choices
-            item_form.product_id.data = item['product_id']
-            item_form.quantity.data = item['quantity']
-            form.products_requested.append_entry(item_form.data)
+            form.products_requested.append_entry({'product_id': str(item['product_id']), 'quantity': item['quantity']})
 
     if form.validate_on_submit():
         products_requested = []
@@ -1185,11 +2021,10 @@ def edit_request(request_id):
             'date': form.date.data,
             'products_requested': products_requested
         }
-        db.requests.update_one({'_id': ObjectId(request_id)}, {'$set': updated_data})
+        db.requests.update_one({'_id': ObjectId(request_id)}, {'$set': normalize('requests', updated_data)})
         flash('Заявку успішно оновлено.', 'success')
         return redirect(url_for('requests_route'))
-    return render_template('requests/request_form.html', form=form, form_type='edit', request_item=request_item,
-                           products=products, trade_points=trade_points)
+    return render_template('requests/request_form.html', form=form, form_type='edit', request_item=request_item)
 
 
 @app.route('/requests/delete/<request_id>')
@@ -1206,39 +2041,35 @@ def delete_request(request_id):
 @app.route('/active_customers', methods=['GET', 'POST'])
 @login_required
 def active_customers():
-    trade_points = list(db.trade_points.find())
+    trade_points = ref_cache.docs('trade_points')
     customers = []
 
     if request.method == 'POST':
         trade_point_type = request.form.get('trade_point_type')
         trade_point_id = request.form.get('trade_point')
-
-        query = {}
-        if trade_point_type:
-            query['type'] = trade_point_type
-        if trade_point_id:
-            query['_id'] = ObjectId(trade_point_id)
-
-        trade_points_to_check = db.trade_points.find(query)
-
-        for tp in trade_points_to_check:
-            sales = db.sales.find({'trade_point_id': tp['_id']})
-            customer_counts = {}
-            for sale in sales:
-                customer_id = sale['customer_id']
-                customer_counts[customer_id] = customer_counts.get(customer_id, 0) + 1
-
-            # Fetch customer names and counts
-            for customer_id, count in customer_counts.items():
-                customer = db.customers.find_one({"_id": customer_id})
-                if customer:
-                    customers.append({
-                        "name": customer['name'],
-                        "count": count
-                    })
-
-    # Sort customers by count in descending order
-    customers = sorted(customers, key=lambda x: x['count'], reverse=True)
+        limit = request.form.get('limit', type=int) or app.config['ACTIVE_CUSTOMERS_LIMIT']
+        # $limit приймає лише додатні значення
+        limit = max(1, min(limit, app.config['ACTIVE_CUSTOMERS_MAX_LIMIT']))
+
+        # Trade points are already loaded for the dropdown, so filter them here
+        match = {"customer_id": {"$ne": None}}
+        if trade_point_type or trade_point_id:
+            match["trade_point_id"] = {"$in": [
+                tp['_id'] for tp in trade_points
+                if (not trade_point_type or tp.get('type') == trade_point_type)
+                and (not trade_point_id or str(tp['_id']) == trade_point_id)
+            ]}
+
+        # Count purchases per customer in Mongo; only the ranked top-N leaves the database
+        customers = list(db.sales.aggregate([
+            {"$match": match},
+            {"$group": {"_id": "$customer_id", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": limit},
+            {"$lookup": {"from": "customers", "localField": "_id", "foreignField": "_id", "as": "customer"}},
+            {"$unwind": "$customer"},
+            {"$project": {"_id": 0, "name": "$customer.name", "count": 1}}
+        ]))
 
     return render_template('queries/active_customers.html', trade_points=trade_points, customers=customers)
 
@@ -1246,8 +2077,8 @@ def active_customers():
 @app.route('/product_volume_prices', methods=['GET', 'POST'])
 @login_required
 def product_volume_prices():
-    trade_points = list(db.trade_points.find())
-    products = list(db.products.find())
+    trade_points = ref_cache.docs('trade_points')
+    products = ref_cache.docs('products')
     results = []
 
     if request.method == 'POST':
@@ -1255,18 +2086,21 @@ def product_volume_prices():
         trade_point_type = request.form.get('trade_point_type')
         trade_point_id = request.form.get('trade_point')
 
-        query = {}
-        if trade_point_type:
-            query['type'] = trade_point_type
-        if trade_point_id:
-            query['_id'] = ObjectId(trade_point_id)
-
-        trade_points_to_check = db.trade_points.find(query)
+        # Trade points are already loaded for the dropdown, so filter them here
+        trade_points_to_check = [
+            tp for tp in trade_points
+            if (not trade_point_type or tp.get('type') == trade_point_type)
+            and (not trade_point_id or str(tp['_id']) == trade_point_id)
+        ]
+        stock = {row['trade_point_id']: row['quantity'] for row in db.stock.find({
+            'product_id': ObjectId(product_id),
+            'trade_point_id': {'$in': [tp['_id'] for tp in trade_points_to_check]}
+        })}
+        product = get_loader().get('products', product_id)
 
         for tp in trade_points_to_check:
-            product_volume = tp.get('inventory', {}).get(str(product_id), 0)
+            product_volume = stock.get(tp['_id'], 0)
 
-            product = db.products.find_one({"_id": ObjectId(product_id)})
             if product:
                 # Extract the price from the first entry in the prices array, if available
                 price_info = product.get("prices", [{}])[0]
@@ -1290,9 +2124,10 @@ def product_volume_prices():
 @app.route('/supplies_info', methods=['GET', 'POST'])
 @login_required
 def supplies_info():
-    suppliers = list(db.suppliers.find())
-    products = list(db.products.find())
+    suppliers = ref_cache.docs('suppliers')
+    products = ref_cache.docs('products')
     results = []
+    total_quantity = 0
 
     if request.method == 'POST':
         supplier_id = request.form.get('supplier')
@@ -1300,45 +2135,51 @@ def supplies_info():
         start_date = request.form.get('start_date')
         end_date = request.form.get('end_date')
 
-        # Build query for supplier orders
-        query = {
+        # Filter the supply ledger by supplier, product and the indexed order_date field
+        match = {
             "supplier_id": ObjectId(supplier_id),
-            "received": True  # Only consider orders that have been received
+            "product_id": ObjectId(product_id)
         }
+        period = date_range(start_date, end_date)
+        if period:
+            match["order_date"] = period
+
+        # Per-order quantities and the grand total in one aggregation
+        report = next(db.supplies.aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": "$supplier_order_id",
+                "order_date": {"$first": "$order_date"},
+                "quantity": {"$sum": "$quantity"}
+            }},
+            {"$sort": {"order_date": 1}},
+            {"$facet": {
+                "orders": [],
+                "total": [{"$group": {"_id": None, "quantity": {"$sum": "$quantity"}}}]
+            }}
+        ]))
 
-        if start_date and end_date:
-            query["order_date"] = {"$gte": start_date, "$lte": end_date}
-
-        # Query supplier orders that match the criteria
-        supplier_orders = db.supplier_orders.find(query)
-
-        # Process the results
-        total_quantity = 0
-        for order in supplier_orders:
-            for request_id in order["related_requests"]:
-                dbrequest = db.requests.find_one({"_id": request_id})
-                if dbrequest:
-                    # Look for the specified product in products_requested
-                    for product_request in dbrequest.get("products_requested", []):
-                        if product_request["product_id"] == ObjectId(product_id):
-                            total_quantity += int(product_request["quantity"])
-
-            # Append each order result to the list with the accumulated quantity
+        loader = get_loader()
+        product = loader.get('products', product_id)
+        supplier = loader.get('suppliers', supplier_id)
+        for order in report["orders"]:
             results.append({
-                "product_name": db.products.find_one({"_id": ObjectId(product_id)})["name"],
-                "supplier_name": db.suppliers.find_one({"_id": ObjectId(supplier_id)})["name"],
-                "order_date": order.get("order_date", "N/A"),
-                "quantity": total_quantity
+                "product_name": product["name"] if product else "N/A",
+                "supplier_name": supplier["name"] if supplier else "N/A",
+                "order_date": order["order_date"].strftime('%Y-%m-%d') if order["order_date"] else "N/A",
+                "quantity": order["quantity"]
             })
+        total_quantity = report["total"][0]["quantity"] if report["total"] else 0
 
-    return render_template('queries/supplies_info.html', suppliers=suppliers, products=products, results=results)
+    return render_template('queries/supplies_info.html', suppliers=suppliers, products=products, results=results,
+                           total_quantity=total_quantity)
 
 
 @app.route('/salaries_info', methods=['GET', 'POST'])
 @login_required
 def salaries_info():
     # Retrieve all trade points for the dropdown filter
-    trade_points = list(db.trade_points.find())
+    trade_points = ref_cache.docs('trade_points')
     salaries = []
 
     if request.method == 'POST':
@@ -1354,13 +2195,17 @@ def salaries_info():
             query['_id'] = ObjectId(trade_point_id)
 
         # Fetch trade points based on the query
-        selected_trade_points = db.trade_points.find(query)
+        selected_trade_points = list(db.trade_points.find(query))
+
+        # All sellers of the selected trade points in one query
+        sellers = get_loader().load('sellers', [seller_id for trade_point in selected_trade_points
+                                                for seller_id in trade_point.get("sellers", [])])
 
         # Loop through each trade point and get seller information
         for trade_point in selected_trade_points:
             trade_point_name = trade_point["name"]
             for seller_id in trade_point.get("sellers", []):  # Loop through seller IDs
-                seller = db.sellers.find_one({"_id": seller_id})
+                seller = sellers.get(to_object_id(seller_id))
                 if seller:
                     salaries.append({
                         "name": seller["name"],  # Seller's name
@@ -1374,7 +2219,7 @@ def salaries_info():
 @app.route('/sales_volume', methods=['GET', 'POST'])
 @login_required
 def sales_volume():
-    products = list(db.products.find())
+    products = ref_cache.docs('products')
     total_volume = 0
     product_name = ""
 
@@ -1386,10 +2231,10 @@ def sales_volume():
         if product:
             product_name = product["name"]
 
-        # Calculate total volume for the selected product
-        total_volume = db.sales.aggregate([
+        # Calculate total volume for the selected product from the daily rollup
+        total_volume = db.sales_daily.aggregate([
             {"$match": {"product_id": ObjectId(product_id)}},
-            {"$group": {"_id": "$product_id", "total_volume": {"$sum": "$volume"}}}
+            {"$group": {"_id": "$product_id", "total_volume": {"$sum": "$quantity"}}}
         ])
 
         # Extract the total volume result
@@ -1419,16 +2264,21 @@ class EditProfileForm(FlaskForm):
 def edit_profile():
     form = EditProfileForm()
     if form.validate_on_submit():
-        db.users.update_one(
-            {'_id': ObjectId(current_user.id)},
-            {'$set': {
-                'username': form.username.data,
-                'email': form.email.data,
-                'first_name': form.first_name.data,
-                'last_name': form.last_name.data,
-                # Додайте інші поля за потреби
-            }}
-        )
+        try:
+            db.users.update_one(
+                {'_id': ObjectId(current_user.id)},
+                {'$set': {
+                    'username': form.username.data,
+                    'email': form.email.data,
+                    'first_name': form.first_name.data,
+                    'last_name': form.last_name.data,
+                    # Додайте інші поля за потреби
+                }}
+            )
+        except DuplicateKeyError:
+            flash('Користувач з таким логіном вже існує.', 'warning')
+            return redirect(url_for('edit_profile'))
+        user_cache.invalidate(current_user.id)
         flash('Ваш профіль було оновлено.', 'success')
         return redirect(url_for('profile'))
     else:
@@ -1443,6 +2293,63 @@ def edit_profile():
     return render_template('edit_profile.html', form=form)
 
 
+# Журнал поставок: один рядок на кожну отриману позицію замовлення постачальнику
+def load_related_requests(orders):
+    request_ids = [to_object_id(request_id) for order in orders for request_id in order.get('related_requests', [])]
+    return {request_item['_id']: request_item for request_item in db.requests.find({'_id': {'$in': request_ids}})}
+
+
+def supply_facts(supplier_order, requests_by_id, received_at):
+    facts = []
+    for request_id in supplier_order.get('related_requests', []):
+        request_item = requests_by_id.get(to_object_id(request_id))
+        if not request_item:
+            continue
+        for product_request in request_item.get('products_requested', []):
+            facts.append({
+                'supplier_order_id': supplier_order['_id'],
+                'request_id': request_item['_id'],
+                'supplier_id': to_object_id(supplier_order['supplier_id']),
+                'product_id': to_object_id(product_request['product_id']),
+                'trade_point_id': to_object_id(request_item['trade_point_id']),
+                'quantity': int(product_request['quantity']),
+                'order_date': to_datetime(supplier_order.get('order_date')),
+                'received_at': received_at
+            })
+    return facts
+
+
+@app.cli.command('backfill-supplies')
+def backfill_supplies():
+    """Перебудувати журнал поставок з уже отриманих замовлень постачальникам."""
+    ensure_indexes('supplies')
+    db.supplies.delete_many({})
+    batch = []
+    total = 0
+    for order in db.supplier_orders.find({'received': True}).batch_size(500):
+        batch.append(order)
+        if len(batch) == 500:
+            total += insert_supply_facts(batch)
+            batch = []
+    total += insert_supply_facts(batch)
+    click.echo(f'Записано рядків поставок: {total}')
+
+
+def insert_supply_facts(orders):
+    requests_by_id = load_related_requests(orders)
+    facts = []
+    for order in orders:
+        received_at = order.get('received_at') or to_datetime(order.get('order_date'))
+        facts.extend(supply_facts(order, requests_by_id, received_at))
+    if facts:
+        db.supplies.insert_many(facts)
+    return len(facts)
+
+
+# Скільки триває захоплення замовлення під час отримання
+RECEIVE_LEASE = datetime.timedelta(minutes=5)
+
+
 @app.route('/supplier_orders/receive/<supplier_order_id>', methods=['GET', 'POST'])
 @login_required
 def receive_supplier_order(supplier_order_id):
@@ -1460,34 +2367,103 @@ def receive_supplier_order(supplier_order_id):
         flash('Це замовлення вже виконано.', 'info')
         return redirect(url_for('supplier_orders'))
 
-    # Distribute products to trade points based on requests
-    for request_id in supplier_order['related_requests']:
-        request_item = db.requests.find_one({'_id': ObjectId(request_id)})
-        trade_point_id = request_item['trade_point_id']
-        for product_request in request_item.get('products_requested', []):
-            product_id = product_request['product_id']
-            quantity = int(product_request['quantity'])
-
-            # Update inventory in the trade point
-            db.trade_points.update_one(
-                {'_id': ObjectId(trade_point_id)},
-                {'$inc': {f'inventory.{product_id}': quantity}}
-            )
-
-    db.supplier_orders.update_one(
-        {'_id': ObjectId(supplier_order_id)},
-        {'$set': {'received': True}}
-    )
+    received_at = datetime.datetime.now()
+    facts = supply_facts(supplier_order, load_related_requests([supplier_order]), received_at)
+
+    # Sum quantities per (trade point, product) so every stock row is touched once
+    increments = {}
+    for fact in facts:
+        key = (fact['trade_point_id'], fact['product_id'])
+        increments[key] = increments.get(key, 0) + fact['quantity']
+
+    def receive(session):
+        # Claim the order with a short lease: a concurrent receive backs off, a retry after a crash resumes
+        claimed = db.supplier_orders.update_one(
+            {'_id': supplier_order['_id'], 'received': {'$ne': True},
+             '$or': [{'receiving_until': {'$exists': False}}, {'receiving_until': {'$lt': received_at}}]},
+            {'$set': {'receiving_until': received_at + RECEIVE_LEASE}},
+            session=session
+        )
+        if claimed.modified_count == 0:
+            return False
+        # Without transactions every step below is idempotent, so a retry finishes what a crash left undone
+        for (trade_point_id, product_id), quantity in increments.items():
+            try:
+                # The order id in pending_receipts marks the increment as applied in the same write
+                db.stock.update_one(
+                    {'trade_point_id': trade_point_id, 'product_id': product_id,
+                     'pending_receipts': {'$ne': supplier_order['_id']}},
+                    {'$inc': {'quantity': quantity}, '$addToSet': {'pending_receipts': supplier_order['_id']}},
+                    upsert=True, session=session
+                )
+            except DuplicateKeyError:
+                # The row already carries this order: the increment was applied by an earlier attempt
+                pass
+        if increments:
+            db.stock_movements.bulk_write([
+                UpdateOne({'ref_id': supplier_order['_id'], 'trade_point_id': trade_point_id,
+                           'product_id': product_id, 'kind': 'receipt'},
+                          {'$setOnInsert': stock_movement(trade_point_id, product_id, quantity, 'receipt',
+                                                          supplier_order['_id'])},
+                          upsert=True)
+                for (trade_point_id, product_id), quantity in increments.items()
+            ], ordered=False, session=session)
+        # Record what the supplier delivered in the supply ledger
+        db.supplies.delete_many({'supplier_order_id': supplier_order['_id']}, session=session)
+        if facts:
+            db.supplies.insert_many(facts, session=session)
+        db.supplier_orders.update_one(
+            {'_id': supplier_order['_id']},
+            {'$set': {'received': True, 'received_at': received_at}, '$unset': {'receiving_until': ''}},
+            session=session
+        )
+        # Markers go only after the order is received; a leftover one is harmless
+        if increments:
+            db.stock.bulk_write([
+                UpdateOne({'trade_point_id': trade_point_id, 'product_id': product_id},
+                          {'$pull': {'pending_receipts': supplier_order['_id']}})
+                for trade_point_id, product_id in increments
+            ], ordered=False, session=session)
+        return True
+
+    if not run_in_transaction(receive):
+        flash('Це замовлення вже виконано або саме зараз отримується.', 'info')
+        return redirect(url_for('supplier_orders'))
     flash('Товар успішно отримано та розподілено по торговельних точках.', 'success')
     return redirect(url_for('supplier_orders'))
 
 
+# Кіоски та лотки не записують покупця
+NO_CUSTOMER_TRADE_POINT_TYPES = ('кіоск', 'лоток')
+
+
+def commit_sale(sale):
+    def write(session):
+        reserved = db.stock.update_one(
+            {'trade_point_id': sale['trade_point_id'], 'product_id': sale['product_id'],
+             'quantity': {'$gte': sale['quantity']}},
+            {'$inc': {'quantity': -sale['quantity']}},
+            session=session
+        )
+        if reserved.modified_count == 0:
+            return False
+        db.sales.insert_one(sale, session=session)
+        db.stock_movements.insert_one(
+            stock_movement(sale['trade_point_id'], sale['product_id'], -sale['quantity'], 'sale', sale['_id']),
+            session=session
+        )
+        apply_sale_to_rollup(sale, session=session)
+        return True
+
+    return run_in_transaction(write)
+
+
 class SaleForm(FlaskForm):
     trade_point_id = SelectField('Trade Point', validators=[DataRequired()])
-    seller_id = SelectField('Seller', validators=[DataRequired()])
-    product_id = SelectField('Product', validators=[DataRequired()])
-    customer_id = SelectField('Customer', choices=[], validators=[])
-    quantity = IntegerField('Quantity', validators=[DataRequired()])
+    seller_id = TypeaheadField('Seller', collection='sellers', validators=[DataRequired()])
+    product_id = TypeaheadField('Product', collection='products', validators=[DataRequired()])
+    customer_id = TypeaheadField('Customer', collection='customers', validators=[Optional()])
+    quantity = IntegerField('Quantity', validators=[DataRequired(), NumberRange(min=1)])
     price = DecimalField('Price', validators=[DataRequired()])
     date = DateField('Date', format='%Y-%m-%d', validators=[DataRequired()])
     submit = SubmitField('Зберегти')
@@ -1503,22 +2479,13 @@ def create_sale():
 
     form = SaleForm()
 
-    # Populate Trade Points Choices
-    trade_points = list(db.trade_points.find())
-    form.trade_point_id.choices = [(str(tp['_id']), tp['name']) for tp in trade_points]
+    # Identity map for the trade point and customer lookups during validation
+    loader = get_loader()
 
-    # Populate Sellers Choices
-    sellers = list(db.sellers.find())
-    form.seller_id.choices = [(str(seller['_id']), seller['name']) for seller in sellers]
-
-    # Populate Products Choices
-    products = list(db.products.find())
-    form.product_id.choices = [(str(product['_id']), product['name']) for product in products]
+    # Populate Trade Points Choices
+    form.trade_point_id.choices = ref_cache.choices('trade_points')
 
-    # Populate Customers Choices
-    customers = list(db.customers.find())
-    form.customer_id.choices = [('', 'Невідомий')] + [(str(customer['_id']), customer['name']) for customer in
-                                                      customers]
+    # Sellers, products and customers are picked by name search (TypeaheadField)
 
     if form.validate_on_submit():
         try:
@@ -1532,18 +2499,19 @@ def create_sale():
                 return redirect(url_for('create_sale'))
 
             # Fetch the selected Trade Point
-            trade_point = db.trade_points.find_one({'_id': trade_point_id})
+            # Тип точки береться з кешу довідників — без окремого запиту до trade_points на кожен продаж
+            trade_point = ref_cache.get('trade_points', trade_point_id)
             if not trade_point:
                 flash('Торговельна точка не знайдена.', 'danger')
                 return redirect(url_for('create_sale'))
 
             # Determine Customer ID based on Trade Point Type
-            if trade_point.get('type') in ['Кіоск', 'Лоток']:
+            if trade_point.get('type', '').lower() in NO_CUSTOMER_TRADE_POINT_TYPES:
                 customer_id = None  # Do not record customer for kiosks and stalls
             else:
                 # Optional: Validate if the customer exists
                 if customer_id:
-                    customer = db.customers.find_one({'_id': customer_id})
+                    customer = loader.get('customers', customer_id)
                     if not customer:
                         flash('Клієнт не знайдений.', 'danger')
                         return redirect(url_for('create_sale'))
@@ -1552,27 +2520,21 @@ def create_sale():
 
             # Prepare the sale document
             sale = {
+                '_id': ObjectId(),
                 'trade_point_id': trade_point_id,
                 'seller_id': seller_id,
                 'product_id': product_id,
                 'quantity': form.quantity.data,
                 'price': float(form.price.data),  # Ensure price is stored as a float
+                'date': form.date.data or datetime.datetime.now(),
                 'customer_id': customer_id
             }
 
-            # Update Product Inventory in the Trade Point
-            update_result = db.trade_points.update_one(
-                {'_id': trade_point_id},
-                {'$inc': {f'inventory.{str(product_id)}': -form.quantity.data}}
-            )
-
-            if update_result.modified_count == 0:
-                flash('Не вдалося оновити залишки товару.', 'warning')
+            # Decrement stock only if enough is left and insert the sale in the same transaction
+            if not commit_sale(normalize('sales', sale)):
+                flash('Недостатньо товару на залишку.', 'warning')
                 return redirect(url_for('create_sale'))
 
-            # Insert the Sale Document into MongoDB
-            db.sales.insert_one(sale)
-
             flash('Продаж успішно додано.', 'success')
             return redirect(url_for('sales'))
 
@@ -1582,7 +2544,219 @@ def create_sale():
             flash('Сталася помилка при додаванні продажу.', 'danger')
             return redirect(url_for('create_sale'))
 
-    return render_template('sales/sale_form.html', form=form, form_type='add')
+    return render_template('sales/sale_form.html', form=form, form_type='add',
+                           trade_points=ref_cache.docs('trade_points'))
+
+
+# Пошук за префіксом назви для полів TypeaheadField
+# колекція -> (колекція фактів, поле посилання, поле дати, вага) для recent_score (refresh-typeahead-scores)
+TYPEAHEAD_SOURCES = {
+    'customers': ('sales', 'customer_id', 'date', 1),
+    'products': ('sales_daily', 'product_id', 'day', '$sale_count'),
+    'sellers': ('sales_daily', 'seller_id', 'day', '$sale_count'),
+    'suppliers': ('supplies', 'supplier_id', 'order_date', 1)
+}
+
+
+@app.route('/api/typeahead/<collection>')
+@login_required
+def typeahead(collection):
+    if collection not in TYPEAHEAD_SOURCES:
+        return jsonify({'error': 'Невідомий довідник.'}), 404
+    prefix = request.args.get('q', '').strip()
+    if not prefix:
+        return jsonify([])
+    limit = request.args.get('limit', type=int) or app.config['TYPEAHEAD_LIMIT']
+    limit = max(1, min(limit, app.config['TYPEAHEAD_MAX_LIMIT']))
+
+    # Діапазон за колацією name_search: U+FFFF має найбільшу вагу, тож [prefix, prefix + U+FFFF)
+    # охоплює всі назви з цим префіксом без урахування регістру
+    name_range = {'$gte': prefix, '$lt': prefix + '\uffff'}
+
+    # Спершу збіги з найбільшим recent_score (індекс typeahead_rank), решту місць заповнюють збіги за абеткою;
+    # обидва запити читають не більше limit документів, хоч би скільки назв мали цей префікс
+    ranked = list(db[collection].find({'name': name_range, 'recent_score': {'$gt': 0}}, {'name': 1})
+                  .collation(NAME_COLLATION).sort([('recent_score', DESCENDING), ('name', ASCENDING)]).limit(limit))
+    if len(ranked) < limit:
+        seen = {doc['_id'] for doc in ranked}
+        alphabetical = (db[collection].find({'name': name_range}, {'name': 1})
+                        .collation(NAME_COLLATION).sort('name', ASCENDING).limit(limit + len(ranked)))
+        ranked += itertools.islice((doc for doc in alphabetical if doc['_id'] not in seen), limit - len(ranked))
+    return jsonify([{'id': str(doc['_id']), 'name': doc['name']} for doc in ranked])
+
+
+def refresh_typeahead_scores():
+    # recent_score — вага документа у фактах за TYPEAHEAD_RECENT_DAYS; документи, що випали з вікна, його втрачають
+    since = datetime.datetime.now() - datetime.timedelta(days=app.config['TYPEAHEAD_RECENT_DAYS'])
+    refreshed_at = datetime.datetime.now()
+    for collection, (source, field, date_field, weight) in TYPEAHEAD_SOURCES.items():
+        updates = (
+            UpdateOne({'_id': row['_id']}, {'$set': {'recent_score': row['score'], 'recent_score_at': refreshed_at}})
+            for row in db[source].aggregate([
+                {'$match': {date_field: {'$gte': since}, field: {'$ne': None}}},
+                {'$group': {'_id': '$' + field, 'score': {'$sum': weight}}}
+            ], allowDiskUse=True)
+        )
+        while True:
+            batch = list(itertools.islice(updates, 1000))
+            if not batch:
+                break
+            db[collection].bulk_write(batch, ordered=False)
+        db[collection].update_many({'recent_score_at': {'$lt': refreshed_at}},
+                                   {'$unset': {'recent_score': '', 'recent_score_at': ''}})
+
+
+@app.cli.command('refresh-typeahead-scores')
+def refresh_typeahead_scores_command():
+    """Перерахувати recent_score для ранжування підказок typeahead (запускати періодично, напр. щогодини)."""
+    refresh_typeahead_scores()
+    click.echo('Рейтинги підказок оновлено.')
+
+
+# Пакетне завантаження продажів з POS-терміналів (JSON-масив або NDJSON)
+class SaleLineError(ValueError):
+    pass
+
+
+def read_sales_batch():
+    if request.mimetype == 'application/x-ndjson':
+        lines = []
+        for text in request.get_data(as_text=True).splitlines():
+            if not text.strip():
+                continue
+            try:
+                lines.append(json.loads(text))
+            except ValueError:
+                lines.append(None)
+        return lines
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get('sales')
+    return payload if isinstance(payload, list) else None
+
+
+def build_batch_sale(line, loader):
+    if not isinstance(line, dict):
+        raise SaleLineError('Рядок не є JSON-об\'єктом.')
+    trade_point = loader.get('trade_points', line.get('trade_point_id'))
+    if not trade_point:
+        raise SaleLineError('Торговельна точка не знайдена.')
+    seller = loader.get('sellers', line.get('seller_id'))
+    if not seller:
+        raise SaleLineError('Продавця не знайдено.')
+    product = loader.get('products', line.get('product_id'))
+    if not product:
+        raise SaleLineError('Товар не знайдено.')
+    quantity = line.get('quantity')
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+        raise SaleLineError('Кількість має бути цілим числом більше нуля.')
+    price = line.get('price')
+    if not isinstance(price, (int, float)) or isinstance(price, bool) or price < 0:
+        raise SaleLineError('Невірна ціна.')
+    sale_date = to_datetime(line.get('date')) if line.get('date') else datetime.datetime.now()
+    if not sale_date:
+        raise SaleLineError('Невірна дата.')
+    customer_id = None
+    # Do not record customer for kiosks and stalls
+    if line.get('customer_id') and trade_point.get('type', '').lower() not in NO_CUSTOMER_TRADE_POINT_TYPES:
+        customer = loader.get('customers', line['customer_id'])
+        if not customer:
+            raise SaleLineError('Клієнт не знайдений.')
+        customer_id = customer['_id']
+    return {
+        '_id': ObjectId(),
+        'trade_point_id': trade_point['_id'],
+        'seller_id': seller['_id'],
+        'product_id': product['_id'],
+        'quantity': quantity,
+        'price': float(price),
+        'date': sale_date,
+        'customer_id': customer_id
+    }
+
+
+@app.route('/api/sales/batch', methods=['POST'])
+@login_required
+def sales_batch():
+    if current_user.role not in ['owner', 'admin', 'operator', 'seller']:
+        return jsonify({'error': 'У вас немає прав доступу.'}), 403
+    lines = read_sales_batch()
+    if lines is None:
+        return jsonify({'error': 'Очікується JSON-масив продажів або NDJSON.'}), 400
+    if len(lines) > app.config['SALES_BATCH_LIMIT']:
+        return jsonify({'error': f'Не більше {app.config["SALES_BATCH_LIMIT"]} продажів за запит.'}), 413
+
+    # Reference data for the whole batch: one $in query per collection
+    loader = get_loader()
+    for collection, field in [('trade_points', 'trade_point_id'), ('sellers', 'seller_id'),
+                              ('products', 'product_id'), ('customers', 'customer_id')]:
+        loader.load(collection, [line.get(field) for line in lines if isinstance(line, dict)])
+
+    errors = []
+    sales = []
+    for number, line in enumerate(lines, start=1):
+        try:
+            sales.append((number, build_batch_sale(line, loader)))
+        except SaleLineError as e:
+            errors.append({'line': number, 'error': str(e)})
+
+    # Lines are served from stock in upload order; the rest are rejected
+    products_by_trade_point = {}
+    for _, sale in sales:
+        products_by_trade_point.setdefault(sale['trade_point_id'], set()).add(sale['product_id'])
+    stock = {}
+    if products_by_trade_point:
+        for row in db.stock.find({'$or': [{'trade_point_id': trade_point_id, 'product_id': {'$in': list(product_ids)}}
+                                          for trade_point_id, product_ids in products_by_trade_point.items()]}):
+            stock[(row['trade_point_id'], row['product_id'])] = row['quantity']
+    accepted = []
+    decrements = {}
+    for number, sale in sales:
+        key = (sale['trade_point_id'], sale['product_id'])
+        if stock.get(key, 0) - decrements.get(key, 0) < sale['quantity']:
+            errors.append({'line': number, 'error': 'Недостатньо товару на залишку.'})
+            continue
+        decrements[key] = decrements.get(key, 0) + sale['quantity']
+        accepted.append((number, sale))
+
+    def write(session):
+        # One guarded decrement per stock row: a row that changed since it was read rejects
+        # only its own lines, and no decrement ever has to be undone (with or without transactions)
+        served = set()
+        for (trade_point_id, product_id), quantity in decrements.items():
+            reserved = db.stock.update_one(
+                {'trade_point_id': trade_point_id, 'product_id': product_id, 'quantity': {'$gte': quantity}},
+                {'$inc': {'quantity': -quantity}},
+                session=session
+            )
+            if reserved.modified_count:
+                served.add((trade_point_id, product_id))
+        sold = [sale for _, sale in accepted if (sale['trade_point_id'], sale['product_id']) in served]
+        if not sold:
+            return sold
+        db.sales.insert_many(sold, ordered=False, session=session)
+        db.stock_movements.insert_many([
+            stock_movement(sale['trade_point_id'], sale['product_id'], -sale['quantity'], 'sale', sale['_id'])
+            for sale in sold
+        ], session=session)
+        rollup = {}
+        for sale in sold:
+            key = tuple(sale_rollup_key(sale).items())
+            totals = rollup.setdefault(key, {'quantity': 0, 'revenue': 0, 'sale_count': 0})
+            totals['quantity'] += sale['quantity']
+            totals['revenue'] += sale['quantity'] * sale['price']
+            totals['sale_count'] += 1
+        db.sales_daily.bulk_write([UpdateOne(dict(key), {'$inc': totals}, upsert=True)
+                                   for key, totals in rollup.items()], ordered=False, session=session)
+        return sold
+
+    sold = {sale['_id'] for sale in run_in_transaction(write)}
+    # Stock changed since it was read: the lines of that stock row are rejected
+    errors += [{'line': number, 'error': 'Недостатньо товару на залишку.'}
+               for number, sale in accepted if sale['_id'] not in sold]
+
+    errors.sort(key=lambda error: error['line'])
+    return jsonify({'accepted': len(sold), 'rejected': len(errors), 'errors': errors})
 
 
 @app.route('/trade_points/view/<trade_point_id>')
@@ -1593,20 +2767,35 @@ def view_trade_point(trade_point_id):
         flash('Торговельну точку не знайдено.', 'danger')
         return redirect(url_for('trade_points'))
     # Отримати інформацію про залишки товару
-    inventory = []
-    for product_id_str, quantity in trade_point.get('inventory', {}).items():
-        product = db.products.find_one({'_id': ObjectId(product_id_str)})
-        inventory.append({
-            'product_name': product['name'] if product else 'Невідомий товар',
-            'quantity': quantity
-        })
+    inventory = list(db.stock.find({'trade_point_id': trade_point['_id']}, {'product_id': 1, 'quantity': 1}))
+    get_loader().attach(inventory, 'product_id', 'products', 'product_name', 'Невідомий товар')
     return render_template('trade_points/trade_point_detail.html', trade_point=trade_point, inventory=inventory)
 
 
+@app.route('/trade_points/<trade_point_id>/adjust_stock', methods=['POST'])
+@login_required
+def adjust_stock(trade_point_id):
+    if current_user.role not in ['owner', 'admin', 'operator']:
+        flash('У вас немає прав доступу до цієї сторінки.', 'danger')
+        return redirect(url_for('access_denied'))
+    trade_point = ref_cache.get('trade_points', trade_point_id)
+    if not trade_point:
+        abort(404)
+    product_id = to_object_id(request.form.get('product_id'))
+    delta = request.form.get('quantity', type=int)
+    # Товар обирається пошуком (typeahead), тож його існування перевіряється тут
+    if not product_id or not delta or not get_loader().get('products', product_id):
+        flash('Вкажіть товар і ненульову кількість.', 'danger')
+        return redirect(url_for('view_trade_point', trade_point_id=trade_point['_id']))
+    change_stock(trade_point['_id'], product_id, delta, 'adjustment')
+    flash('Залишок товару скориговано.', 'success')
+    return redirect(url_for('view_trade_point', trade_point_id=trade_point['_id']))
+
+
 @app.route('/profitability', methods=['GET', 'POST'])
 @login_required
 def profitability():
-    trade_points = list(db.trade_points.find())
+    trade_points = ref_cache.docs('trade_points')
     profitability_results = []
 
     if request.method == 'POST':
@@ -1614,84 +2803,122 @@ def profitability():
         start_date = request.form.get('start_date')
         end_date = request.form.get('end_date')
 
-        # Build the query for sales based on trade point and date range
-        query = {"trade_point_id": ObjectId(trade_point_id)}
-        if start_date and end_date:
-            query["date"] = {"$gte": start_date, "$lte": end_date}
-
-        # Retrieve sales records for the selected trade point and date range
-        sales_records = db.sales.find(query)
-
-        # Calculate total revenue by summing (quantity * price) for each sale
-        total_revenue = sum(record["quantity"] * record["price"] for record in sales_records)
-
-        # Retrieve trade point details for overhead costs
-        trade_point = db.trade_points.find_one({"_id": ObjectId(trade_point_id)})
-        if trade_point:
-            # Rent and utility payments from trade_point
-            rent_payments = trade_point.get("rent_payments", 0)
-            utility_payments = trade_point.get("utility_payments", 0)
-
-            # Calculate total salaries for sellers at this trade point
-            total_salaries = sum(seller["salary"] for seller in db.sellers.find({"trade_point_id": ObjectId(trade_point_id)}))
-
-            # Calculate total overhead costs (rent, utility, salaries)
-            overhead_costs = rent_payments + utility_payments + total_salaries
-
-            # Calculate profit and profitability ratio
-            profit = total_revenue - overhead_costs
-            profitability_ratio = total_revenue / overhead_costs if overhead_costs else 0
-
-            # Append the result to the list
-            profitability_results.append({
-                "trade_point_name": trade_point.get("name", "Unknown"),
-                "total_revenue": total_revenue,
-                "overhead_costs": overhead_costs,
-                "profit": profit,
-                "profitability_ratio": profitability_ratio
-            })
+        # Without a trade point the report ranks every trade point
+        sales_match = {}
+        trade_point_match = {}
+        if trade_point_id:
+            sales_match["trade_point_id"] = ObjectId(trade_point_id)
+            trade_point_match["_id"] = ObjectId(trade_point_id)
+        period = date_range(start_date, end_date)
+        if period:
+            sales_match["day"] = period
+
+        # Revenue comes from the daily sales rollup instead of raw sales
+        profitability_results = list(db.sales_daily.aggregate([
+            {"$match": sales_match},
+            # Revenue per trade point
+            {"$group": {"_id": "$trade_point_id", "total_revenue": {"$sum": "$revenue"}}},
+            # Trade points without sales in the period still get a row
+            {"$unionWith": {"coll": "trade_points", "pipeline": [
+                {"$match": trade_point_match},
+                {"$project": {"total_revenue": {"$literal": 0}}}
+            ]}},
+            {"$group": {"_id": "$_id", "total_revenue": {"$sum": "$total_revenue"}}},
+            # Rent, utility payments and salaries of the trade point
+            {"$lookup": {"from": "trade_points", "localField": "_id", "foreignField": "_id", "as": "trade_point"}},
+            {"$unwind": "$trade_point"},
+            {"$lookup": {"from": "sellers", "localField": "_id", "foreignField": "trade_point_id", "as": "sellers"}},
+            {"$addFields": {"overhead_costs": {"$add": [
+                {"$ifNull": ["$trade_point.rent_payments", 0]},
+                {"$ifNull": ["$trade_point.utility_payments", 0]},
+                {"$sum": "$sellers.salary"}
+            ]}}},
+            {"$project": {
+                "_id": 0,
+                "trade_point_name": "$trade_point.name",
+                "total_revenue": 1,
+                "overhead_costs": 1,
+                "profit": {"$subtract": ["$total_revenue", "$overhead_costs"]},
+                "profitability_ratio": {"$cond": [
+                    {"$gt": ["$overhead_costs", 0]},
+                    {"$divide": ["$total_revenue", "$overhead_costs"]},
+                    0
+                ]}
+            }},
+            {"$sort": {"profit": -1}}
+        ]))
 
     return render_template('queries/profitability.html', trade_points=trade_points,
                            profitability_results=profitability_results)
 
 
+# Формат підпису періоду для кожного розміру інтервалу товарообігу
+TURNOVER_BUCKETS = {
+    'day': '%Y-%m-%d',
+    'week': '%Y-%m-%d',
+    'month': '%Y-%m'
+}
+
+
 @app.route('/trade_turnover', methods=['GET', 'POST'])
 @login_required
 def trade_turnover():
-    trade_points = list(db.trade_points.find())
+    trade_points = ref_cache.docs('trade_points')
     turnover_results = []
 
     if request.method == 'POST':
-        trade_point_id = request.form.get('trade_point')
+        trade_point_ids = request.form.getlist('trade_point')
         start_date = request.form.get('start_date')
         end_date = request.form.get('end_date')
+        bucket = request.form.get('bucket')
+        if bucket not in TURNOVER_BUCKETS:
+            bucket = 'day'
+        by_product = bool(request.form.get('by_product'))
+
+        # Build the match for sales based on trade points and date range
+        match = {}
+        if trade_point_ids:
+            match["trade_point_id"] = {"$in": [ObjectId(tp_id) for tp_id in trade_point_ids]}
+        period = date_range(start_date, end_date)
+        if period:
+            match["day"] = period
+
+        # Group sold quantities from the daily rollup into day/week/month buckets on the server
+        date_trunc = {"date": "$day", "unit": bucket}
+        if bucket == 'week':
+            date_trunc["startOfWeek"] = "monday"
+        group_id = {"period": {"$dateTrunc": date_trunc}, "trade_point_id": "$trade_point_id"}
+        if by_product:
+            group_id["product_id"] = "$product_id"
+        series = db.sales_daily.aggregate([
+            {"$match": match},
+            {"$group": {"_id": group_id, "total_quantity_sold": {"$sum": "$quantity"}}},
+            {"$sort": {"_id.period": 1, "_id.trade_point_id": 1}}
+        ])
 
-        # Build the query for sales based on trade point and date range
-        query = {"trade_point_id": ObjectId(trade_point_id)}
-        if start_date and end_date:
-            query["date"] = {"$gte": start_date, "$lte": end_date}
-
-        # Retrieve sales records and calculate total quantity sold
-        sales_records = db.sales.find(query)
-        total_quantity_sold = sum(sale.get("quantity", 0) for sale in sales_records)
-
-        # Retrieve trade point name for display
-        trade_point = db.trade_points.find_one({"_id": ObjectId(trade_point_id)})
-        trade_point_name = trade_point.get("name", "Unknown") if trade_point else "Unknown"
+        for row in series:
+            turnover_results.append({
+                "period": row["_id"]["period"].strftime(TURNOVER_BUCKETS[bucket]),
+                "trade_point_id": row["_id"]["trade_point_id"],
+                "product_id": row["_id"].get("product_id"),
+                "total_quantity_sold": row["total_quantity_sold"]
+            })
 
-        # Append the result to the list
-        turnover_results.append({
-            "trade_point_name": trade_point_name,
-            "total_quantity_sold": total_quantity_sold
-        })
+        # Trade point names come from the dropdown list, product names from one $in query
+        trade_point_names = {tp['_id']: tp['name'] for tp in trade_points}
+        for row in turnover_results:
+            row['trade_point_name'] = trade_point_names.get(row['trade_point_id'], 'Unknown')
+        if by_product:
+            get_loader().attach(turnover_results, 'product_id', 'products', 'product_name', 'Unknown')
 
-    return render_template('queries/trade_turnover.html', trade_points=trade_points, turnover_results=turnover_results)
+    return render_template('queries/trade_turnover.html', trade_points=trade_points, turnover_results=turnover_results,
+                           by_product=request.form.get('by_product'))
 
 
 @app.route('/customers_for_product', methods=['GET', 'POST'])
 @login_required
 def customers_for_product():
-    products = list(db.products.find())
+    products = ref_cache.docs('products')
     customers = []
 
     if request.method == 'POST':
@@ -1700,29 +2927,22 @@ def customers_for_product():
         start_date = request.form.get('start_date')
         end_date = request.form.get('end_date')
 
-        # Build query to find sales of the specified product
-        query = {"product_id": ObjectId(product_id)}
-        if start_date and end_date:
-            query["date"] = {"$gte": start_date, "$lte": end_date}
-
-        # Fetch sales and count purchases per customer
-        sales = db.sales.find(query)
-        customer_counts = {}
-
-        # Aggregate total volume for each customer
-        for sale in sales:
-            customer_id = sale["customer_id"]
-            volume = sale.get("volume", 0)
-            customer_counts[customer_id] = customer_counts.get(customer_id, 0) + volume
-
-        for customer_id, total_volume in customer_counts.items():
-            if total_volume >= min_quantity:
-                customer = db.customers.find_one({"_id": customer_id})
-                if customer:
-                    customers.append({
-                        "name": customer['name'],
-                        "total_volume": total_volume
-                    })
+        # Sales of the product in the period, as datetimes like every other report
+        match = {"product_id": ObjectId(product_id), "customer_id": {"$ne": None}}
+        period = date_range(start_date, end_date)
+        if period:
+            match["date"] = period
+
+        # Total quantity per customer and customer names in one aggregation
+        customers = list(db.sales.aggregate([
+            {"$match": match},
+            {"$group": {"_id": "$customer_id", "total_volume": {"$sum": "$quantity"}}},
+            {"$match": {"total_volume": {"$gte": min_quantity}}},
+            {"$sort": {"total_volume": -1, "_id": 1}},
+            {"$lookup": {"from": "customers", "localField": "_id", "foreignField": "_id", "as": "customer"}},
+            {"$unwind": "$customer"},
+            {"$project": {"_id": 0, "name": "$customer.name", "total_volume": 1}}
+        ]))
 
     return render_template('queries/customers_for_product.html', products=products, customers=customers)
 
@@ -1730,18 +2950,30 @@ def customers_for_product():
 @app.route('/product_range_volume', methods=['GET', 'POST'])
 @login_required
 def product_range_volume():
-    trade_points = list(db.trade_points.find())
+    trade_points = ref_cache.docs('trade_points')
     inventory_results = []
 
     if request.method == 'POST':
         trade_point_id = request.form.get('trade_point')
-
-        trade_point = db.trade_points.find_one({"_id": ObjectId(trade_point_id)})
-        if trade_point:
-            for product_id, volume in trade_point.get("inventory", {}).items():
-                product = db.products.find_one({"_id": ObjectId(product_id)})
-                if product:
-                    inventory_results.append({"product_name": product["name"], "volume": volume})
+        as_of = to_datetime(request.form.get('as_of'))
+
+        history_start = stock_history_start(trade_point_id) if as_of else None
+        if as_of and (not history_start or as_of + datetime.timedelta(days=1) <= history_start):
+            # Без знімка чи початкового руху журнал дав би залишки без початкового балансу
+            flash('Немає історії залишків на цю дату' +
+                  (f' (дані є з {history_start:%Y-%m-%d}).' if history_start else '.'), 'warning')
+            stock = []
+        elif as_of:
+            # Залишки на кінець обраного дня зі знімків і журналу руху товарів
+            quantities = stock_as_of(trade_point_id, as_of + datetime.timedelta(days=1, microseconds=-1))
+            stock = [{"product_id": product_id, "quantity": quantity} for product_id, quantity in quantities.items()]
+        else:
+            stock = list(db.stock.find({"trade_point_id": ObjectId(trade_point_id)}))
+        products = get_loader().load('products', [row["product_id"] for row in stock])
+        for row in stock:
+            product = products.get(row["product_id"])
+            if product:
+                inventory_results.append({"product_name": product["name"], "volume": row["quantity"]})
 
     return render_template('queries/product_range_volume.html', trade_points=trade_points,
                            inventory_results=inventory_results)
@@ -1755,7 +2987,7 @@ def create_supplier_order():
         return redirect(url_for('access_denied'))
 
     # Get suppliers and requests from the database
-    suppliers = list(db.suppliers.find())
+    suppliers = ref_cache.docs('suppliers')
     pending_requests = list(db.requests.find())
 
     if request.method == 'POST':
@@ -1771,7 +3003,7 @@ def create_supplier_order():
             'related_requests': [ObjectId(req_id) for req_id in selected_requests]
         }
 
-        db.supplier_orders.insert_one(supplier_order)
+        db.supplier_orders.insert_one(normalize('supplier_orders', supplier_order))
         flash('Замовлення постачальнику успішно створено.', 'success')
         return redirect(url_for('requests_route'))
 
@@ -1785,6 +3017,334 @@ def reports():
     return render_template('queries/index.html')
 
 
+# Панель власника: незалежні віджети виконуються паралельно, кожен у власному потоці.
+# Кожен віджет має свій строк (DASHBOARD_WIDGET_TIMEOUTS або DASHBOARD_TIMEOUT): усі його запити,
+# разом із підвантаженням назв, отримують maxTimeMS до цього строку, а сторінка показує те, що встигло
+def widget_revenue_today(deadline):
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    totals = next(db.sales_daily.aggregate([
+        {'$match': {'day': today}},
+        {'$group': {'_id': None, 'revenue': {'$sum': '$revenue'}, 'quantity': {'$sum': '$quantity'},
+                    'sale_count': {'$sum': '$sale_count'}}}
+    ], maxTimeMS=time_left_ms(deadline)), None)
+    return totals or {'revenue': 0, 'quantity': 0, 'sale_count': 0}
+
+
+def widget_turnover(deadline):
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    days = [today - datetime.timedelta(days=offset) for offset in range(6, -1, -1)]
+    totals = {row['_id']: row for row in db.sales_daily.aggregate([
+        {'$match': {'day': {'$gte': days[0]}}},
+        {'$group': {'_id': '$day', 'revenue': {'$sum': '$revenue'}, 'quantity': {'$sum': '$quantity'}}}
+    ], maxTimeMS=time_left_ms(deadline))}
+    return [{'day': day, 'revenue': totals.get(day, {}).get('revenue', 0),
+             'quantity': totals.get(day, {}).get('quantity', 0)} for day in days]
+
+
+def widget_top_customers(deadline):
+    since = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=30), datetime.time())
+    return list(db.sales.aggregate([
+        {'$match': {'date': {'$gte': since}, 'customer_id': {'$ne': None}}},
+        {'$group': {'_id': '$customer_id', 'count': {'$sum': 1},
+                    'revenue': {'$sum': {'$multiply': ['$quantity', '$price']}}}},
+        {'$sort': {'revenue': -1, '_id': 1}},
+        {'$limit': app.config['DASHBOARD_LIMIT']},
+        {'$lookup': {'from': 'customers', 'localField': '_id', 'foreignField': '_id', 'as': 'customer'}},
+        {'$unwind': '$customer'},
+        {'$project': {'_id': 0, 'name': '$customer.name', 'count': 1, 'revenue': 1}}
+    ], maxTimeMS=time_left_ms(deadline)))
+
+
+def widget_low_stock(deadline):
+    rows = list(db.stock.find({'quantity': {'$lte': app.config['LOW_STOCK_THRESHOLD']}},
+                              {'trade_point_id': 1, 'product_id': 1, 'quantity': 1})
+                .sort('quantity', ASCENDING).limit(app.config['DASHBOARD_LIMIT']).max_time_ms(time_left_ms(deadline)))
+    loader = RefLoader(db, deadline)
+    loader.attach(rows, 'trade_point_id', 'trade_points', 'trade_point_name')
+    loader.attach(rows, 'product_id', 'products', 'product_name')
+    return rows
+
+
+def widget_pending_orders(deadline):
+    query = {'received': {'$ne': True}}
+    oldest = list(db.supplier_orders.find(query, {'supplier_id': 1, 'order_date': 1})
+                  .sort('order_date', ASCENDING).limit(app.config['DASHBOARD_LIMIT'])
+                  .max_time_ms(time_left_ms(deadline)))
+    RefLoader(db, deadline).attach(oldest, 'supplier_id', 'suppliers', 'supplier_name')
+    return {'count': db.supplier_orders.count_documents(query, maxTimeMS=time_left_ms(deadline)), 'oldest': oldest}
+
+
+DASHBOARD_WIDGETS = {
+    'revenue_today': widget_revenue_today,
+    'turnover': widget_turnover,
+    'top_customers': widget_top_customers,
+    'low_stock': widget_low_stock,
+    'pending_orders': widget_pending_orders
+}
+
+
+@app.route('/dashboard')
+@login_required
+def dashboard():
+    if current_user.role not in ['owner', 'admin']:
+        flash('У вас немає прав доступу до цієї сторінки.', 'danger')
+        return redirect(url_for('access_denied'))
+
+    started = time.monotonic()
+    deadlines = {name: started + app.config['DASHBOARD_WIDGET_TIMEOUTS'].get(name, app.config['DASHBOARD_TIMEOUT'])
+                 for name in DASHBOARD_WIDGETS}
+    commands, pending = g.get('mongo_commands'), g.get('mongo_pending')
+
+    def run_widget(widget, deadline):
+        # Потік пулу має власний g: команди віджета дописуються до метрик цього запиту
+        if commands is not None:
+            g.mongo_commands = commands
+            g.mongo_pending = pending
+        return widget(deadline)
+
+    # Пул на один запит: віджет, що не встиг, не займає потік, на який чекали б інші запити,
+    # а його запити сервер перериває за maxTimeMS
+    executor = ThreadPoolExecutor(len(DASHBOARD_WIDGETS), thread_name_prefix='dashboard')
+    futures = {name: executor.submit(copy_current_request_context(run_widget), widget, deadlines[name])
+               for name, widget in DASHBOARD_WIDGETS.items()}
+    widgets = {}
+    failed = {}
+    for name, future in futures.items():
+        try:
+            widgets[name] = future.result(timeout=max(0, deadlines[name] - time.monotonic()))
+        except (FutureTimeoutError, ExecutionTimeout):
+            # Або віджет ще працює, або сервер уже перервав його запит за maxTimeMS
+            failed[name] = 'Дані не встигли завантажитися.'
+        except Exception as e:
+            app.logger.error(f"Error building dashboard widget {name}: {e}")
+            failed[name] = 'Не вдалося завантажити дані.'
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    return render_template('dashboard.html', widgets=widgets, failed=failed)
+
+
+# Метрики запитів і команд Mongo
+@app.before_request
+def start_command_recording():
+    g.request_started = time.perf_counter()
+    g.mongo_commands = []
+    g.mongo_pending = {}
+
+
+@app.after_request
+def record_command_metrics(response):
+    if 'mongo_commands' not in g:
+        return response
+    route = request.endpoint or 'unknown'
+    elapsed = time.perf_counter() - g.request_started
+    commands = g.mongo_commands
+    finds = {}
+    for shape, _ in commands:
+        if shape.startswith('find '):
+            finds[shape] = finds.get(shape, 0) + 1
+    # Та сама форма find більше ніж REPEATED_FIND_THRESHOLD разів за запит — ознака N+1
+    repeated = [shape for shape, count in finds.items() if count > app.config['REPEATED_FIND_THRESHOLD']]
+    for shape in repeated:
+        app.logger.warning('N+1: %s виконав "%s" %d разів', route, shape, finds[shape])
+    route_metrics.record(route, elapsed, commands, repeated)
+    if app.config['MONGO_DEBUG_HEADER']:
+        response.headers['X-Mongo-Commands'] = '%d; %.1fms%s' % (
+            len(commands), sum(duration for _, duration in commands) * 1000,
+            ''.join(f'; repeated={shape}' for shape in repeated)
+        )
+    return response
+
+
+def prometheus_labels(**labels):
+    escaped = {key: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for key, value in labels.items()}
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped.items()) + '}'
+
+
+def metrics_allowed():
+    token = app.config['METRICS_TOKEN']
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    return current_user.is_authenticated and current_user.role in ['owner', 'admin']
+
+
+@app.route('/metrics')
+def metrics():
+    # Назви маршрутів, колекцій і форми запитів не повинні бути публічними
+    if not metrics_allowed():
+        return 'Forbidden\n', 403, {'Content-Type': 'text/plain; charset=utf-8'}
+    snapshot = route_metrics.snapshot()
+    lines = [
+        '# HELP trader_http_requests_total HTTP requests by route.',
+        '# TYPE trader_http_requests_total counter'
+    ]
+    lines += [f'trader_http_requests_total{prometheus_labels(route=route)} {count}'
+              for route, count in snapshot['requests'].items()]
+    lines += [
+        '# HELP trader_http_request_seconds_total Time spent handling requests by route.',
+        '# TYPE trader_http_request_seconds_total counter'
+    ]
+    lines += [f'trader_http_request_seconds_total{prometheus_labels(route=route)} {seconds:.6f}'
+              for route, seconds in snapshot['request_seconds'].items()]
+    lines += [
+        '# HELP trader_mongo_commands_total Mongo commands by route and command.',
+        '# TYPE trader_mongo_commands_total counter'
+    ]
+    lines += [f'trader_mongo_commands_total{prometheus_labels(route=route, command=command)} {count}'
+              for (route, command), count in snapshot['commands'].items()]
+    lines += [
+        '# HELP trader_mongo_command_seconds_total Time spent in Mongo commands by route and command.',
+        '# TYPE trader_mongo_command_seconds_total counter'
+    ]
+    lines += [f'trader_mongo_command_seconds_total{prometheus_labels(route=route, command=command)} {seconds:.6f}'
+              for (route, command), seconds in snapshot['command_seconds'].items()]
+    lines += [
+        '# HELP trader_mongo_repeated_find_total Requests that repeated the same find shape above the threshold.',
+        '# TYPE trader_mongo_repeated_find_total counter'
+    ]
+    lines += [f'trader_mongo_repeated_find_total{prometheus_labels(route=route, shape=shape)} {count}'
+              for (route, shape), count in snapshot['repeated_finds'].items()]
+    stats = user_cache.stats()
+    lines += [
+        '# HELP trader_user_cache_lookups_total User loader cache lookups by result.',
+        '# TYPE trader_user_cache_lookups_total counter',
+        f'trader_user_cache_lookups_total{prometheus_labels(result="hit")} {stats["hits"]}',
+        f'trader_user_cache_lookups_total{prometheus_labels(result="miss")} {stats["misses"]}',
+        '# HELP trader_user_cache_hit_ratio Share of user loader lookups served from the cache.',
+        '# TYPE trader_user_cache_hit_ratio gauge',
+        f'trader_user_cache_hit_ratio {stats["hit_ratio"]:.6f}'
+    ]
+    return '\n'.join(lines) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+# Профілювання окремих запитів: ?profile=1 або заголовок X-Profile (лише owner/admin),
+# або кожен PROFILE_SAMPLE_RATE-й запит (0 — вимкнено)
+# Фаза вибірки визначається за найглибшим кадром із відомої бібліотеки, решта — код самого view
+PROFILE_PHASES = (
+    ('db', ('/pymongo/', '/bson/')),
+    ('template', ('/jinja2/',)),
+    ('form', ('/wtforms/', '/flask_wtf/'))
+)
+
+
+class SamplingProfiler:
+    # Окремий потік раз на interval знімає стек потоку, що обробляє запит
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.phases = {'db': 0, 'form': 0, 'view': 0, 'template': 0}
+        self.samples = 0
+        self.elapsed = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.thread.start()
+
+    def stop(self):
+        if self.stop_event.is_set():
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.sample(frame)
+
+    def sample(self, frame):
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        # Лише кадри всередині view: хуки before/after_request і сам WSGI-сервер не рахуються
+        for index, code in enumerate(codes):
+            if code.co_name == 'dispatch_request' and code.co_filename.replace('\\', '/').endswith('/flask/app.py'):
+                codes = codes[index + 1:]
+                break
+        else:
+            return
+        phase = 'view'
+        for code in reversed(codes):
+            filename = code.co_filename.replace('\\', '/')
+            phase = next((name for name, markers in PROFILE_PHASES if any(marker in filename for marker in markers)),
+                         None)
+            if phase:
+                break
+        self.phases[phase or 'view'] += 1
+        self.samples += 1
+        stack = ';'.join(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+                         for code in codes)
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def phase_seconds(self):
+        if not self.samples:
+            return {phase: 0 for phase in self.phases}
+        return {phase: self.elapsed * count / self.samples for phase, count in self.phases.items()}
+
+    def write(self, path, root):
+        # Згорнуті стеки (формат stackcollapse): flamegraph.pl, speedscope, inferno
+        with open(path, 'w', encoding='utf-8') as profile:
+            for stack, count in sorted(self.stacks.items()):
+                profile.write(f'{root};{stack} {count}\n')
+
+
+def profiling_requested():
+    if request.endpoint in (None, 'static'):
+        return False
+    # Лише явний запит власника чи адміністратора отримує підсумок у заголовку X-Profile
+    if request.args.get('profile') or request.headers.get('X-Profile'):
+        g.profile_requested = current_user.is_authenticated and current_user.role in ['owner', 'admin']
+        if g.profile_requested:
+            return True
+    # Випадкова вибірка лише пише профіль і рядок у журнал
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    return bool(rate) and random.randrange(rate) == 0
+
+
+@app.before_request
+def start_profiler():
+    if profiling_requested():
+        g.profiler = SamplingProfiler(threading.get_ident(), app.config['PROFILE_INTERVAL'])
+        g.profiler.start()
+
+
+@app.after_request
+def write_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.stop()
+    os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+    path = os.path.join(app.config['PROFILE_DIR'],
+                        f'{datetime.datetime.now():%Y%m%d-%H%M%S-%f}-{request.endpoint}.folded')
+    profiler.write(path, request.endpoint)
+    phases = profiler.phase_seconds()
+    # Точний час у Mongo з RequestCommandListener поряд з оцінкою за вибірками
+    mongo_seconds = sum(duration for _, duration in g.get('mongo_commands', []))
+    summary = '%s; %.1fms; %d samples; %s; mongo=%.1fms' % (
+        path, profiler.elapsed * 1000, profiler.samples,
+        ' '.join(f'{phase}={seconds * 1000:.1f}ms' for phase, seconds in phases.items()), mongo_seconds * 1000
+    )
+    app.logger.info('Профіль %s: %s', request.endpoint, summary)
+    if g.get('profile_requested'):
+        response.headers['X-Profile'] = summary
+    return response
+
+
+@app.teardown_request
+def stop_profiler(exc):
+    # Необроблений виняток обминає after_request — потік вибірки все одно треба зупинити
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+
+
 # Обробка помилок
 @app.errorhandler(404)
 def page_not_found(e):
@@ -1796,6 +3356,32 @@ def internal_server_error(e):
     return render_template('error.html', error_message='Внутрішня помилка сервера.'), 500
 
 
-# Запуск додатку
+# Фабрика застосунку: додаткова конфігурація і власний пул Mongo в кожному процесі
+def init_mongo():
+    global client, db, user_cache, ref_cache
+    client.close()
+    client = mongo_client(app.config)
+    db = client.get_default_database('Trader')
+    user_cache = UserCache(db, app.config['USER_CACHE_TTL'], app.config['USER_CACHE_MAX_ENTRIES'],
+                           app.config['USER_CACHE_SYNC_INTERVAL'])
+    ref_cache = RefCache(db, app.config['REF_CACHE_TTL'], app.config['REF_CACHE_MAX_ENTRIES'])
+
+
+def create_app(config=None):
+    # Маршрути зареєстровані на модульному app, тож фабрика налаштовує і повертає саме його
+    if config:
+        app.config.update(config)
+    init_mongo()
+    if app.config['ENSURE_INDEXES']:
+        ensure_indexes()
+    return app
+
+
+# Команди seed-data, benchmark і load-test (bench.py) реєструються на цьому ж app;
+# сервер розробки (python app.py) їх не потребує
+if __name__ != '__main__':
+    import bench
+
+# Запуск додатку (сервер розробки; production — див. wsgi.py)
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
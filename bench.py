@@ -0,0 +1,559 @@
+# Синтетична база, бенчмарк маршрутів і навантажувальний тест Trader.
+# Команди seed-data, benchmark і load-test реєструються на app з app.py.
+# db і кеші переприв'язує create_app(), тому до них звертаємося через модуль trader.
+import datetime
+import http.cookiejar
+import itertools
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import click
+from bson.objectid import ObjectId
+from flask import url_for
+from pymongo import ReturnDocument, uri_parser
+from werkzeug.security import generate_password_hash
+
+import app as trader
+from app import (app, route_metrics, ensure_indexes, insert_supply_facts, rebuild_sales_rollup,
+                 refresh_typeahead_scores, stock_movement, to_object_id, NO_CUSTOMER_TRADE_POINT_TYPES,
+                 REF_COLLECTIONS)
+
+# Синтетична база Trader для бенчмарків
+SEED_COLLECTIONS = ('trade_points', 'sellers', 'suppliers', 'products', 'customers', 'requests', 'supplier_orders',
+                    'sales', 'sales_daily', 'supplies', 'stock', 'stock_movements', 'stock_snapshots')
+SEED_PRODUCT_WORDS = ['Хліб', 'Молоко', 'Сир', 'Кава', 'Чай', 'Цукор', 'Борошно', 'Олія', 'Масло', 'Йогурт', 'Сік',
+                      'Вода', 'Печиво', 'Шоколад', 'Рис', 'Гречка', 'Мед', 'Ковбаса', 'Кефір', 'Сметана']
+SEED_FIRST_NAMES = ['Олена', 'Олег', 'Ольга', 'Петро', 'Марія', 'Іван', 'Андрій', 'Наталія', 'Тарас', 'Ірина',
+                    'Богдан', 'Світлана', 'Юрій', 'Оксана', 'Василь', 'Галина']
+SEED_LAST_NAMES = ['Шевченко', 'Коваленко', 'Бондаренко', 'Ткаченко', 'Кравченко', 'Олійник', 'Мельник', 'Бойко',
+                   'Савченко', 'Руденко', 'Мороз', 'Лисенко', 'Павленко', 'Гончар']
+
+
+def insert_in_batches(collection, documents, batch_size):
+    ids = []
+    batch = []
+    for doc in documents:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            ids.extend(trader.db[collection].insert_many(batch, ordered=False).inserted_ids)
+            batch = []
+    if batch:
+        ids.extend(trader.db[collection].insert_many(batch, ordered=False).inserted_ids)
+    return ids
+
+
+LOCAL_MONGO_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+
+def is_local_mongo_uri(uri):
+    # mongodb+srv завжди вказує на DNS-запис, тобто на віддалений кластер
+    if not uri.startswith('mongodb://'):
+        return False
+    nodes = uri_parser.parse_uri(uri)['nodelist']
+    return all(host in LOCAL_MONGO_HOSTS or host.endswith('.sock') for host, _ in nodes)
+
+
+@app.cli.command('seed-data')
+@click.option('--seed', default=42, show_default=True, help='Зерно генератора: той самий seed дає ту саму базу.')
+@click.option('--trade-points', default=20, show_default=True)
+@click.option('--sellers-per-point', default=5, show_default=True)
+@click.option('--suppliers', 'supplier_count', default=50, show_default=True)
+@click.option('--products', 'product_count', default=1000, show_default=True)
+@click.option('--customers', 'customer_count', default=20000, show_default=True)
+@click.option('--requests', 'request_count', default=2000, show_default=True)
+@click.option('--supplier-orders', 'order_count', default=1000, show_default=True)
+@click.option('--sales', 'sale_count', default=1000000, show_default=True)
+@click.option('--days', default=365, show_default=True, help='Продажі та заявки розподіляються на стільки днів назад.')
+@click.option('--batch-size', default=10000, show_default=True)
+@click.option('--drop', is_flag=True, help='Очистити колекції перед заповненням.')
+@click.option('--bench-password', required=True, help='Пароль користувача bench (власник).')
+@click.option('--allow-remote', is_flag=True, help='Дозволити MONGO_URI не на localhost.')
+def seed_data(seed, trade_points, sellers_per_point, supplier_count, product_count, customer_count, request_count,
+              order_count, sale_count, days, batch_size, drop, bench_password, allow_remote):
+    """Заповнити локальну базу синтетичними даними Trader."""
+    # Команда створює власника bench і з --drop видаляє колекції, тож чужу базу не чіпаємо без явного дозволу
+    if not allow_remote and not is_local_mongo_uri(app.config['MONGO_URI']):
+        raise click.ClickException('MONGO_URI вказує не на localhost; '
+                                   'додайте --allow-remote, якщо це справді тестова база.')
+    rng = random.Random(seed)
+    if drop:
+        for collection in SEED_COLLECTIONS:
+            trader.db[collection].drop()
+    ensure_indexes()
+    today = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def moment():
+        return today - datetime.timedelta(days=rng.randrange(days), seconds=rng.randrange(86400))
+
+    trade_point_types = ['універмаг', 'магазин', 'кіоск', 'лоток']
+    trade_point_docs = [{
+        '_id': ObjectId(),
+        'name': f'Точка {i + 1:03d}',
+        'type': rng.choice(trade_point_types),
+        'size': rng.randint(10, 2000),
+        'rent_payments': rng.randint(1000, 50000),
+        'utility_payments': rng.randint(200, 10000),
+        'number_of_counters': rng.randint(1, 20),
+        'halls': [],
+        'sections': [],
+        'sellers': [],
+        'products': []
+    } for i in range(trade_points)]
+    seller_docs = []
+    for trade_point in trade_point_docs:
+        for _ in range(sellers_per_point):
+            seller = {
+                '_id': ObjectId(),
+                'name': f'{rng.choice(SEED_FIRST_NAMES)} {rng.choice(SEED_LAST_NAMES)}',
+                'trade_point_id': trade_point['_id'],
+                'salary': rng.randint(8000, 30000)
+            }
+            trade_point['sellers'].append(seller['_id'])
+            seller_docs.append(seller)
+    insert_in_batches('trade_points', trade_point_docs, batch_size)
+    insert_in_batches('sellers', seller_docs, batch_size)
+
+    supplier_ids = insert_in_batches('suppliers', ({
+        'name': f'Постачальник {i + 1:03d}',
+        'contact_info': f'+380{rng.randint(100000000, 999999999)}'
+    } for i in range(supplier_count)), batch_size)
+    product_docs = [{
+        '_id': ObjectId(),
+        'name': f'{rng.choice(SEED_PRODUCT_WORDS)} {i + 1:05d}',
+        'description': '',
+        'suppliers': rng.sample(supplier_ids, min(len(supplier_ids), rng.randint(1, 3))),
+        'prices': [{'amount': round(rng.uniform(5, 500), 2), 'currency': 'UAH'}]
+    } for i in range(product_count)]
+    insert_in_batches('products', product_docs, batch_size)
+    customer_ids = insert_in_batches('customers', ({
+        'name': f'{rng.choice(SEED_FIRST_NAMES)} {rng.choice(SEED_LAST_NAMES)} {i + 1}',
+        'characteristics': ''
+    } for i in range(customer_count)), batch_size)
+
+    request_docs = [{
+        '_id': ObjectId(),
+        'date': moment(),
+        'trade_point_id': rng.choice(trade_point_docs)['_id'],
+        'products_requested': [{'product_id': product['_id'], 'quantity': rng.randint(1, 100)}
+                               for product in rng.sample(product_docs, min(len(product_docs), rng.randint(1, 5)))]
+    } for _ in range(request_count)]
+    insert_in_batches('requests', request_docs, batch_size)
+    order_docs = []
+    for _ in range(order_count):
+        order_date = moment()
+        order = {
+            '_id': ObjectId(),
+            'supplier_id': rng.choice(supplier_ids),
+            'order_date': order_date,
+            'related_requests': [request_item['_id'] for request_item in
+                                 rng.sample(request_docs, min(len(request_docs), rng.randint(1, 3)))]
+        }
+        # Більшість замовлень уже отримано, решта чекає на /supplier_orders/receive
+        if rng.random() < 0.8:
+            order['received'] = True
+            order['received_at'] = order_date + datetime.timedelta(days=rng.randint(1, 7))
+        order_docs.append(order)
+    insert_in_batches('supplier_orders', order_docs, batch_size)
+    for start in range(0, len(order_docs), 500):
+        insert_supply_facts([order for order in order_docs[start:start + 500] if order.get('received')])
+
+    stock_rows = []
+    for trade_point in trade_point_docs:
+        for product in rng.sample(product_docs, len(product_docs) // 3):
+            stock_rows.append((trade_point['_id'], product['_id'], rng.randint(0, 500)))
+    insert_in_batches('stock', ({'trade_point_id': trade_point_id, 'product_id': product_id, 'quantity': quantity}
+                                for trade_point_id, product_id, quantity in stock_rows), batch_size)
+    insert_in_batches('stock_movements', (stock_movement(trade_point_id, product_id, quantity, 'adjustment')
+                                          for trade_point_id, product_id, quantity in stock_rows), batch_size)
+
+    # Популярність товарів спадає за законом Ципфа, тож звіти бачать і хіти, і «довгий хвіст»
+    product_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(product_docs))))
+    sellers_by_trade_point = {trade_point['_id']: trade_point['sellers'] for trade_point in trade_point_docs}
+
+    def sales():
+        for product in rng.choices(product_docs, cum_weights=product_weights, k=sale_count):
+            trade_point = rng.choice(trade_point_docs)
+            with_customer = trade_point['type'] not in NO_CUSTOMER_TRADE_POINT_TYPES and rng.random() < 0.7
+            yield {
+                'trade_point_id': trade_point['_id'],
+                'seller_id': rng.choice(sellers_by_trade_point[trade_point['_id']]),
+                'product_id': product['_id'],
+                'customer_id': rng.choice(customer_ids) if with_customer and customer_ids else None,
+                'quantity': rng.randint(1, 5),
+                'price': product['prices'][0]['amount'],
+                'date': moment()
+            }
+
+    insert_in_batches('sales', sales(), batch_size)
+    rebuild_sales_rollup()
+    refresh_typeahead_scores()
+
+    bench_user = trader.db.users.find_one_and_update({'username': 'bench'}, {'$set': {
+        'password': generate_password_hash(bench_password),
+        'role': 'owner'
+    }}, upsert=True, projection={'_id': 1}, return_document=ReturnDocument.AFTER)
+    for collection in REF_COLLECTIONS:
+        trader.ref_cache.invalidate(collection)
+    # Кеш користувачів ключується за _id, а не за логіном
+    trader.user_cache.invalidate(bench_user['_id'])
+    click.echo(f'Згенеровано: точок {len(trade_point_docs)}, продавців {len(seller_docs)}, товарів {len(product_docs)}, '
+               f'покупців {len(customer_ids)}, заявок {len(request_docs)}, замовлень {len(order_docs)}, '
+               f'продажів {sale_count}.')
+
+
+# Бенчмарк маршрутів через тестовий клієнт Flask
+# Максимум команд Mongo на один запит; маршрути, яких тут немає, мають DEFAULT_QUERY_BUDGET
+DEFAULT_QUERY_BUDGET = 12
+QUERY_BUDGETS = {
+    'GET sales': 10,
+    'GET products': 6,
+    'GET customers': 5,
+    'GET requests_route': 6,
+    'GET view_trade_point': 8,
+    'GET create_sale': 5,
+    'POST profitability': 6,
+    'POST trade_turnover': 6,
+    'POST receive_supplier_order': 10
+}
+# Змінні маршрутів -> колекція, з якої береться зразковий документ
+BENCHMARK_ARGS = {
+    'sale_id': 'sales',
+    'trade_point_id': 'trade_points',
+    'product_id': 'products',
+    'seller_id': 'sellers',
+    'supplier_id': 'suppliers',
+    'customer_id': 'customers',
+    'request_id': 'requests',
+    'order_id': 'supplier_orders',
+    'supplier_order_id': 'supplier_orders',
+    'user_id': 'users'
+}
+# Звітні форми, які бенчмарк також надсилає POST-запитом
+BENCHMARK_FORMS = {
+    'profitability': lambda s: {'trade_point': s['trade_points'], 'start_date': s['start'], 'end_date': s['end']},
+    'trade_turnover': lambda s: {'trade_point': s['trade_points'], 'start_date': s['start'], 'end_date': s['end'],
+                                 'bucket': 'month'},
+    'sales_volume': lambda s: {'product': s['products']},
+    'active_customers': lambda s: {'trade_point_type': 'магазин'},
+    'supplies_info': lambda s: {'supplier': s['suppliers'], 'product': s['products'], 'start_date': s['start'],
+                                'end_date': s['end']},
+    'customers_for_product': lambda s: {'product': s['products'], 'start_date': s['start'], 'end_date': s['end'],
+                                        'min_quantity': 1},
+    'product_volume_prices': lambda s: {'product': s['products']},
+    'suppliers_for_product': lambda s: {'product': s['products'], 'min_quantity': 0},
+    'salaries_info': lambda s: {'trade_point_type': 'магазин'},
+    'product_range_volume': lambda s: {'trade_point': s['trade_points']}
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def route_command_count(route):
+    return sum(count for (command_route, _), count in route_metrics.snapshot()['commands'].items()
+               if command_route == route)
+
+
+@app.cli.command('benchmark')
+@click.option('--repeat', default=20, show_default=True, help='Виміряних запитів на маршрут.')
+@click.option('--warmup', default=2, show_default=True, help='Запитів на маршрут перед вимірюванням.')
+@click.option('--username', default='bench', show_default=True)
+@click.option('--password', required=True, help='Пароль, заданий у seed-data --bench-password.')
+@click.option('--route', 'only', multiple=True, help='Лише вказані endpoint-и (можна повторювати).')
+def benchmark(repeat, warmup, username, password, only):
+    """Виміряти p50/p95 і кількість команд Mongo для кожного маршруту.
+
+    Запускати на базі з seed-data: POST /supplier_orders/receive отримує справжні замовлення.
+    """
+    app.config['WTF_CSRF_ENABLED'] = False
+    test_client = app.test_client()
+    if test_client.post('/login', data={'username': username, 'password': password}).status_code != 302:
+        raise click.ClickException(f'Не вдалося увійти як {username}; спочатку запустіть seed-data.')
+    samples = {collection: str(doc['_id']) for collection in set(BENCHMARK_ARGS.values())
+               for doc in trader.db[collection].find({}, {'_id': 1}).limit(1)}
+    samples.update({
+        'start': (datetime.date.today() - datetime.timedelta(days=90)).isoformat(),
+        'end': datetime.date.today().isoformat()
+    })
+    pending_orders = [order['_id'] for order in trader.db.supplier_orders.find({'received': {'$ne': True}}, {'_id': 1})
+                      .limit(repeat + warmup)]
+
+    cases = []
+    with app.test_request_context():
+        receive_urls = [url_for('receive_supplier_order', supplier_order_id=order_id) for order_id in pending_orders]
+        for rule in app.url_map.iter_rules():
+            if rule.endpoint in ('static', 'logout', 'metrics') or rule.endpoint.startswith('delete_'):
+                continue
+            if only and rule.endpoint not in only:
+                continue
+            if any(BENCHMARK_ARGS.get(argument) not in samples for argument in rule.arguments):
+                continue
+            url = url_for(rule.endpoint, **{argument: samples[BENCHMARK_ARGS[argument]] for argument in rule.arguments})
+            # receive_supplier_order змінює дані й на GET, тож його вимірює лише POST нижче
+            if 'GET' in rule.methods and rule.endpoint != 'receive_supplier_order':
+                cases.append(('GET', rule.endpoint, lambda run, url=url: test_client.get(url)))
+            if rule.endpoint in BENCHMARK_FORMS:
+                data = BENCHMARK_FORMS[rule.endpoint](samples)
+                cases.append(('POST', rule.endpoint, lambda run, url=url, data=data: test_client.post(url, data=data)))
+            # Кожен виміряний POST отримує інше замовлення, яке ще чекає на отримання
+            if rule.endpoint == 'receive_supplier_order' and len(receive_urls) >= repeat + warmup:
+                cases.append(('POST', rule.endpoint, lambda run: test_client.post(receive_urls[run])))
+
+    failures = []
+    click.echo(f'{"маршрут":45} {"p50 мс":>8} {"p95 мс":>8} {"команд":>7} {"бюджет":>7}')
+    for method, endpoint, call in cases:
+        name = f'{method} {endpoint}'
+        latencies = []
+        commands = 0
+        for run in range(warmup + repeat):
+            before = route_command_count(endpoint)
+            # Окремий контекст застосунку на запит: інакше g (і кеші в ньому) спільний з контекстом CLI
+            with app.app_context():
+                started = time.perf_counter()
+                response = call(run)
+                elapsed = time.perf_counter() - started
+            if response.status_code >= 400:
+                failures.append(f'{name}: HTTP {response.status_code}')
+                break
+            if run >= warmup:
+                latencies.append(elapsed * 1000)
+                commands = max(commands, route_command_count(endpoint) - before)
+        if not latencies:
+            continue
+        budget = QUERY_BUDGETS.get(name, DEFAULT_QUERY_BUDGET)
+        status = '' if commands <= budget else '  ПЕРЕВИЩЕНО'
+        click.echo(f'{name:45} {percentile(latencies, 0.5):8.1f} {percentile(latencies, 0.95):8.1f} '
+                   f'{commands:7} {budget:7}{status}')
+        if commands > budget:
+            failures.append(f'{name}: {commands} команд при бюджеті {budget}')
+    if failures:
+        raise click.ClickException('; '.join(failures))
+
+
+# Навантажувальний тест: каси, перегляд списків, звіти та приймання поставок одночасно
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class LoadClient:
+    # Сесія одного віртуального користувача: cookie, CSRF-токен, запити без переходу за редиректами
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect()
+        )
+        self.csrf_token = None
+
+    def request(self, method, path, data=None):
+        body = None
+        if data is not None:
+            body = urllib.parse.urlencode(dict(data, csrf_token=self.csrf_token or ''), doseq=True).encode()
+        http_request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(http_request, timeout=60) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.headers, error.read()
+
+    def login(self, username, password):
+        _, _, page = self.request('GET', '/login')
+        match = re.search(rb'name="csrf_token" type="hidden" value="([^"]+)"', page)
+        self.csrf_token = match.group(1).decode() if match else None
+        status, _, _ = self.request('POST', '/login', {'username': username, 'password': password})
+        return status == 302
+
+
+def load_sale(client, rng, samples):
+    trade_point_id, product_id = rng.choice(samples['stock'])
+    status, headers, _ = client.request('POST', '/sales/create', {
+        'trade_point_id': str(trade_point_id),
+        'seller_id': str(rng.choice(samples['sellers'][trade_point_id])),
+        'product_id': str(product_id),
+        'customer_id': str(rng.choice(samples['customers'])) if samples['customers'] and rng.random() < 0.7 else '',
+        'quantity': rng.randint(1, 3),
+        'price': '10.00',
+        'date': datetime.date.today().isoformat()
+    })
+    # Успішний продаж веде на список продажів, відмова (немає залишку) — назад на форму
+    if status == 302 and not headers.get('Location', '').endswith('/sales'):
+        return status, 'rejected'
+    return status, None
+
+
+def load_browse(client, rng, samples):
+    return client.request('GET', rng.choice(['/sales', '/products', '/customers', '/requests']))[0], None
+
+
+def load_report(client, rng, samples):
+    today = datetime.date.today()
+    period = {'start_date': (today - datetime.timedelta(days=90)).isoformat(), 'end_date': today.isoformat()}
+    path, data = rng.choice([
+        ('/profitability', dict(period, trade_point=str(rng.choice(list(samples['sellers']))))),
+        ('/trade_turnover', dict(period, bucket='week')),
+        ('/sales_volume', {'product': str(rng.choice(samples['stock'])[1])})
+    ])
+    return client.request('POST', path, data)[0], None
+
+
+def load_receive(client, rng, samples):
+    # Замовлення вибираються з поверненням, тож паралельні спроби отримати те саме замовлення неминучі
+    if not samples['orders']:
+        return None, 'skipped'
+    return client.request('POST', f'/supplier_orders/receive/{rng.choice(samples["orders"])}', {})[0], None
+
+
+LOAD_ACTIONS = {
+    'sale': load_sale,
+    'browse': load_browse,
+    'report': load_report,
+    'receive': load_receive
+}
+
+
+def server_status():
+    try:
+        return trader.db.command('serverStatus')
+    except Exception:
+        return None
+
+
+def inventory_problems():
+    problems = {'negative_stock': trader.db.stock.count_documents({'quantity': {'$lt': 0}})}
+    # Кожна позиція замовлення має потрапити на склад рівно один раз
+    problems['double_receipts'] = len(list(trader.db.stock_movements.aggregate([
+        {'$match': {'kind': 'receipt'}},
+        {'$group': {'_id': {'ref_id': '$ref_id', 'trade_point_id': '$trade_point_id', 'product_id': '$product_id'},
+                    'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ])))
+    # Залишок має дорівнювати сумі руху товару за цією парою
+    ledger = {(row['_id']['trade_point_id'], row['_id']['product_id']): row['quantity']
+              for row in trader.db.stock_movements.aggregate([
+                  {'$group': {'_id': {'trade_point_id': '$trade_point_id', 'product_id': '$product_id'},
+                              'quantity': {'$sum': '$quantity'}}}
+              ])}
+    problems['stock_ledger_mismatches'] = sum(
+        1 for row in trader.db.stock.find({}, {'trade_point_id': 1, 'product_id': 1, 'quantity': 1})
+        if ledger.get((row['trade_point_id'], row['product_id']), 0) != row['quantity']
+    )
+    return problems
+
+
+@app.cli.command('load-test')
+@click.option('--base-url', default='http://127.0.0.1:5000', show_default=True)
+@click.option('--concurrency', default=50, show_default=True, help='Кількість одночасних віртуальних користувачів.')
+@click.option('--duration', default=60, show_default=True, help='Тривалість у секундах.')
+@click.option('--mix', default='sale=70,browse=15,report=10,receive=5', show_default=True,
+              help='Частки дій: sale, browse, report, receive.')
+@click.option('--seed', default=1, show_default=True)
+@click.option('--username', default='bench', show_default=True)
+@click.option('--password', required=True, help='Пароль, заданий у seed-data --bench-password.')
+def load_test(base_url, concurrency, duration, mix, seed, username, password):
+    """Змішане навантаження на запущений застосунок: пропускна здатність, хвіст затримок і цілісність залишків."""
+    weights = {}
+    for part in mix.split(','):
+        action, _, weight = part.partition('=')
+        if action.strip() not in LOAD_ACTIONS:
+            raise click.BadParameter(f'невідома дія {action!r}', param_hint='--mix')
+        weights[action.strip()] = float(weight)
+    actions = list(weights)
+
+    sellers = {}
+    for seller in trader.db.sellers.find({}, {'trade_point_id': 1}):
+        sellers.setdefault(to_object_id(seller['trade_point_id']), []).append(seller['_id'])
+    samples = {
+        'sellers': sellers,
+        'stock': [(row['trade_point_id'], row['product_id']) for row in
+                  trader.db.stock.find({'quantity': {'$gt': 0}, 'trade_point_id': {'$in': list(sellers)}},
+                                {'trade_point_id': 1, 'product_id': 1}).limit(5000)],
+        'customers': [doc['_id'] for doc in trader.db.customers.find({}, {'_id': 1}).limit(1000)],
+        'orders': [doc['_id'] for doc in trader.db.supplier_orders.find({'received': {'$ne': True}}, {'_id': 1}).limit(1000)]
+    }
+    if not samples['stock']:
+        raise click.ClickException('Немає залишків для продажу; спочатку запустіть seed-data.')
+
+    results = []
+    status_samples = []
+    deadline = time.monotonic() + duration
+    stop = threading.Event()
+
+    def worker(number):
+        rng = random.Random(seed + number)
+        client = LoadClient(base_url)
+        if not client.login(username, password):
+            results.append(('login', 0, None, 'error'))
+            return
+        while time.monotonic() < deadline:
+            action = rng.choices(actions, weights=[weights[name] for name in actions])[0]
+            started = time.perf_counter()
+            try:
+                status, outcome = LOAD_ACTIONS[action](client, rng, samples)
+            except OSError:
+                status, outcome = None, 'error'
+            if status is not None and status >= 400:
+                outcome = 'error'
+            results.append((action, time.perf_counter() - started, status, outcome))
+
+    def monitor():
+        while not stop.wait(1):
+            status = server_status()
+            if status:
+                status_samples.append(status)
+
+    before = server_status()
+    monitor_thread = threading.Thread(target=monitor, daemon=True)
+    monitor_thread.start()
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(concurrency)]
+    started = time.monotonic()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.monotonic() - started
+    stop.set()
+    monitor_thread.join()
+    after = server_status()
+
+    click.echo(f'{"дія":10} {"запитів":>8} {"за с":>8} {"p50 мс":>8} {"p95 мс":>8} {"p99 мс":>8} {"помилок":>8} '
+               f'{"відмов":>7}')
+    for action in actions + ['login']:
+        rows = [row for row in results if row[0] == action]
+        if not rows:
+            continue
+        latencies = [row[1] * 1000 for row in rows]
+        errors = sum(1 for row in rows if row[3] == 'error')
+        rejected = sum(1 for row in rows if row[3] == 'rejected')
+        click.echo(f'{action:10} {len(rows):8} {len(rows) / elapsed:8.1f} {percentile(latencies, 0.5):8.1f} '
+                   f'{percentile(latencies, 0.95):8.1f} {percentile(latencies, 0.99):8.1f} {errors:8} {rejected:7}')
+    click.echo(f'Усього: {len(results)} запитів за {elapsed:.1f} с ({len(results) / elapsed:.1f} за с)')
+
+    if before and after:
+        queues = [sample['globalLock']['currentQueue']['total'] for sample in status_samples if 'globalLock' in sample]
+        active = [sample['globalLock']['activeClients']['total'] for sample in status_samples
+                  if 'globalLock' in sample]
+        click.echo(f'Mongo: черга блокувань макс. {max(queues, default=0)}, активних клієнтів макс. '
+                   f'{max(active, default=0)}')
+        waits = {}
+        for resource, modes in after.get('locks', {}).items():
+            for mode, count in modes.get('acquireWaitCount', {}).items():
+                waits[f'{resource}.{mode}'] = count - before.get('locks', {}).get(resource, {}) \
+                    .get('acquireWaitCount', {}).get(mode, 0)
+        click.echo('Mongo: очікувань блокувань ' + (', '.join(f'{name}={count}' for name, count in waits.items()
+                                                             if count) or 'немає'))
+        operations = {name: after['opcounters'][name] - before['opcounters'].get(name, 0)
+                      for name in after.get('opcounters', {})}
+        click.echo('Mongo: операцій ' + ', '.join(f'{name}={count}' for name, count in operations.items()))
+
+    problems = inventory_problems()
+    click.echo('Цілісність: ' + ', '.join(f'{name}={count}' for name, count in problems.items()))
+    # Розбіжність із журналом лише показуємо: залишки, внесені до появи stock_movements, журналу не мають
+    if problems['negative_stock'] or problems['double_receipts']:
+        raise click.ClickException('Порушено цілісність залишків.')
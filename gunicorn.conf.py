@@ -0,0 +1,19 @@
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+# Процеси використовують усі ядра, потоки перекривають очікування на Mongo всередині процесу
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = 60
+graceful_timeout = 30
+# Без preload кожен воркер сам імпортує wsgi.py і відкриває свій пул з'єднань
+preload_app = False
+
+
+def post_fork(server, worker):
+    # З preload_app = True застосунок імпортовано в майстрі: пул з'єднань створюємо заново в кожному воркері
+    if server.cfg.preload_app:
+        import app
+        app.init_mongo()
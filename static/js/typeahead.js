@@ -0,0 +1,79 @@
+// Пошук за префіксом назви для полів TypeaheadField.
+// Поле пошуку (data-typeahead) підвантажує варіанти з /api/typeahead/<collection>,
+// а вибраний варіант додається в <select> з id = data-target.
+(function () {
+    var timers = {};
+
+    function optionsFor(input) {
+        if (!input.list) {
+            var list = document.createElement('datalist');
+            list.id = input.dataset.target + '_options';
+            input.parentNode.insertBefore(list, input.nextSibling);
+            input.setAttribute('list', list.id);
+        }
+        return input.list;
+    }
+
+    function choose(input, id, name) {
+        var select = document.getElementById(input.dataset.target);
+        if (!select.multiple) {
+            select.innerHTML = '';
+        }
+        var exists = Array.prototype.some.call(select.options, function (option) {
+            return option.value === id;
+        });
+        if (!exists) {
+            select.add(new Option(name, id, true, true));
+        }
+        // Одиночне поле показує вибрану назву, щоб її можна було стерти
+        input.value = select.multiple ? '' : name;
+        select.dispatchEvent(new Event('change'));
+    }
+
+    function clear(input) {
+        var select = document.getElementById(input.dataset.target);
+        if (!select.multiple && select.options.length) {
+            select.innerHTML = '';
+            select.dispatchEvent(new Event('change'));
+        }
+    }
+
+    document.addEventListener('input', function (event) {
+        var input = event.target;
+        if (!input.dataset || !input.dataset.typeahead) {
+            return;
+        }
+        var list = optionsFor(input);
+        // Порожнє поле пошуку скидає вибір (напр. необов'язкового покупця)
+        if (!input.value.trim()) {
+            clear(input);
+            return;
+        }
+        // Вибір одного з підказаних варіантів
+        var picked = Array.prototype.find.call(list.options, function (option) {
+            return option.value === input.value;
+        });
+        if (picked) {
+            choose(input, picked.dataset.id, picked.value);
+            return;
+        }
+        clearTimeout(timers[input.dataset.target]);
+        timers[input.dataset.target] = setTimeout(function () {
+            var prefix = input.value.trim();
+            if (!prefix) {
+                return;
+            }
+            fetch(input.dataset.typeahead + '?q=' + encodeURIComponent(prefix))
+                .then(function (response) { return response.json(); })
+                .then(function (items) {
+                    list.innerHTML = '';
+                    items.forEach(function (item) {
+                        var option = document.createElement('option');
+                        option.value = item.name;
+                        option.dataset.id = item.id;
+                        list.appendChild(option);
+                    });
+                });
+        }, 200);
+    });
+})();
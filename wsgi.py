@@ -0,0 +1,24 @@
+# Точка входу для production: кілька процесів-воркерів, у кожному кілька потоків
+#
+#     gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Кожен воркер імпортує цей модуль уже після fork, тож create_app() створює власний MongoClient
+# у кожному процесі. Налаштування беруться зі змінних середовища з префіксом TRADER_
+# (значення розбираються як JSON), наприклад:
+#
+#     TRADER_MONGO_URI='mongodb://db1,db2,db3/Trader?replicaSet=rs0' \
+#     TRADER_MONGO_MAX_POOL_SIZE=16 TRADER_MONGO_WRITE_CONCERN='"majority"' \
+#     TRADER_SECRET_KEY='"..."' gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Кількість з'єднань до Mongo зверху обмежена workers × MONGO_MAX_POOL_SIZE.
+#
+# Команди flask (seed-data, load-test, benchmark, migrate-*, ensure-indexes) запускаються через ту саму фабрику
+# і з тими самими змінними TRADER_*:
+#
+#     TRADER_MONGO_URI='mongodb://db1/Trader' flask --app app:create_app ensure-indexes
+#
+# Налаштування самого gunicorn мають префікс GUNICORN_ (GUNICORN_BIND, GUNICORN_WORKERS, GUNICORN_THREADS)
+# і в конфігурацію застосунку не потрапляють.
+from app import create_app
+
+app = create_app()